@@ -1,18 +1,60 @@
 #!/usr/bin/env python3
 # Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
-"""Combines and filters dissertation lists."""
+"""Combines and filters dissertation lists.
+
+Also writes a registry that assigns each student a compact integer key and
+stores school, year, field and Scopus ID as typed columns.  Later stages
+join on these keys and restore the string ID (`Name;University;Year`) only
+when exporting.
+"""
 
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 SOURCE_FILE = Path("./001_students/main.tab")
 TARGET_FILE = Path("./005_student_lists/main.csv")
+REGISTRY_FILE = Path("./005_student_lists/registry.parquet")
 OUTPUT_FOLDER = Path("./990_output/")
 
 ACADEMIC_YEARS = ('2000-2001', '2001-2002', '2002-2003', '2003-2004')
 
 
+def make_registry(df):
+    """Create registry of students indexed by integer keys.
+
+    School and year are parts of the ID, which is the published identifier;
+    the respective columns disagree with it for a few students.
+    """
+    cols = ["stu_jel", "stu_scopus"]
+    registry = df[cols].rename_axis("stu_id").reset_index()
+    parts = registry["stu_id"].str.rsplit(";", n=2, expand=True)
+    registry.insert(1, "stu_school", parts[1])
+    registry.insert(2, "stu_year", parts[2])
+    registry["stu_scopus"] = pd.to_numeric(registry["stu_scopus"])
+    registry = registry.astype({"stu_id": str, "stu_school": "category",
+                                "stu_year": "uint16", "stu_jel": "category",
+                                "stu_scopus": "UInt64"})
+    registry.index.name = "stu_key"
+    return registry
+
+
+def read_registry(fname=REGISTRY_FILE):
+    """Read registry of students indexed by integer keys."""
+    return pd.read_parquet(fname)
+
+
+def student_ids(keys, registry):
+    """Restore string IDs of students from their integer keys."""
+    return registry["stu_id"].to_numpy()[np.asarray(keys)]
+
+
+def student_keys(ids, registry):
+    """Find integer keys of students by their string IDs (-1 if unknown)."""
+    return pd.Index(registry["stu_id"]).get_indexer(ids)
+
+
 def write_stats(stat_dct):
     """Write out textfiles as "filename: content" pair."""
     from pathlib import Path
@@ -45,6 +87,7 @@ def main():
               "Scopus_ID": "stu_scopus", "repec_handle": "stu_repec"}
     df = df.rename(columns=rename).sort_values(['stu_year', 'stu_school', 'Name'])
     df.to_csv(TARGET_FILE, index_label="stu_id")
+    make_registry(df).to_parquet(REGISTRY_FILE)
 
     # Statistics
     stats = {'N_of_PhDsOld': nphds1, 'N_of_PhDs': df.shape[0],
@@ -1,31 +1,104 @@
 #!/usr/bin/env python3
 # Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
-"""Crawls genealogy.repec.org for adviser information."""
+"""Crawls genealogy.repec.org for adviser information.
 
+Pages are fetched concurrently through a pooled session with a polite
+per-host delay and stored on disk together with their ETag and
+Last-Modified headers.  Subsequent runs only re-download pages that changed,
+and parsing always works off the stored HTML.  The index of validators is
+persisted while crawling.
+
+fixture_servers.py provides a local stand-in for genealogy.repec.org to
+try the crawler offline via `crawl(..., base_url=...)`.
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
 
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 SOURCE_FILE = Path('./005_student_lists/main.csv')
 TARGET_FILE = Path('./050_adviser_genealogy.repec/repec.csv')
+STORE_FOLDER = Path('./050_adviser_genealogy.repec/html/')
 
+BASE_URL = 'https://genealogy.repec.org/pages/'
+MAX_WORKERS = 4  # No. of parallel connections
+MIN_INTERVAL = 0.5  # Minimum no. of seconds between two requests to one host
+REFRESH = True  # Revalidate stored pages; set False to parse offline only
+SAVE_EVERY = 50  # No. of fetched pages after which the index is persisted
 
-def crawl(handle):
-    """Attempt to extract supervisor information from genealogy.repec.org."""
-    url = 'https://genealogy.repec.org/pages/' + handle + '.html'
-    r = requests.get(url)
-    advisers = [("-", "-")]
+
+class HostRateLimiter:
+    """Enforce a minimum interval between requests to the same host."""
+    def __init__(self, min_interval=MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._lock = Lock()
+        self._next = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.min_interval
+        sleep(max(slot - now, 0))
+
+
+def crawl(handles, index, max_workers=MAX_WORKERS, base_url=BASE_URL):
+    """Fetch pages for all handles concurrently and update the index,
+    persisting it every SAVE_EVERY pages and on failure.
+    """
+    session = make_session(max_workers)
+    limiter = HostRateLimiter()
+    STORE_FOLDER.mkdir(parents=True, exist_ok=True)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch, h, session, limiter,
+                                       index.get(h, {}), base_url)
+                       for h in handles]
+            for i, future in enumerate(tqdm(as_completed(futures),
+                                            total=len(futures)), start=1):
+                handle, meta = future.result()
+                index[handle] = meta
+                if i % SAVE_EVERY == 0:
+                    write_index(index)
+    finally:
+        write_index(index)
+    return index
+
+
+def fetch(handle, session, limiter, meta, base_url=BASE_URL):
+    """Conditionally download the page of a handle into the store."""
+    url = base_url + handle + '.html'
+    if not store_path(handle).exists():
+        meta = {}  # Validators are worthless without the stored page
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    limiter.wait(url)
+    try:
+        r = session.get(url, headers=headers, timeout=30)
+    except requests.exceptions.RequestException as e:
+        print(f"... {handle}: {type(e).__name__}")
+        return handle, meta
+    if r.status_code == 304:
+        return handle, meta
+    meta = {'status': r.status_code, 'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified')}
     if r.status_code < 400:
-        soup = BeautifulSoup(r.text, 'lxml')
-        adv_tags = soup.find('ol')
-        advisers = []
-        for adv_tag in adv_tags.findAll('li'):
-            advisers.append(get_names_and_links(adv_tag))
-    adv_names = "; ".join(x[0] for x in advisers)
-    adv_urls = "; ".join(x[1] for x in advisers)
-    return pd.Series({'adviser_name': adv_names, 'adviser_url': adv_urls})
+        store_path(handle).write_text(r.text, encoding="utf8")
+    return handle, meta
 
 
 def get_names_and_links(tag):
@@ -40,11 +113,67 @@ def get_names_and_links(tag):
     return name, url
 
 
+def make_session(pool_size, retries=3):
+    """Create session with connection pool and retries on server errors."""
+    retry = Retry(total=retries, backoff_factor=1,
+                  status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def parse(handle, index):
+    """Attempt to extract supervisor information from stored page."""
+    advisers = [("-", "-")]
+    fname = store_path(handle)
+    if index.get(handle, {}).get('status', 404) < 400 and fname.exists():
+        soup = BeautifulSoup(fname.read_text(encoding="utf8"), 'lxml')
+        adv_tags = soup.find('ol')
+        advisers = []
+        for adv_tag in adv_tags.findAll('li'):
+            advisers.append(get_names_and_links(adv_tag))
+    adv_names = "; ".join(x[0] for x in advisers)
+    adv_urls = "; ".join(x[1] for x in advisers)
+    return pd.Series({'adviser_name': adv_names, 'adviser_url': adv_urls})
+
+
+def read_index():
+    """Read index of stored pages with their cache validators."""
+    try:
+        return json.loads((STORE_FOLDER/"index.json").read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def store_path(handle):
+    """Return path of stored page for a handle."""
+    return STORE_FOLDER/(handle.replace("/", "_") + '.html')
+
+
+def write_index(index):
+    """Atomically write index of stored pages."""
+    fname = STORE_FOLDER/"index.json"
+    tmp = fname.with_suffix(".tmp")
+    tmp.write_text(json.dumps(index, indent=1))
+    tmp.replace(fname)
+
+
 def main():
     cols = ['stu_id', 'stu_repec']
     stu_df = pd.read_csv(SOURCE_FILE, index_col='stu_id', usecols=cols).dropna()
 
-    adv_df = stu_df['stu_repec'].apply(crawl)
+    # Fetch pages
+    index = read_index()
+    if REFRESH:
+        handles = sorted(stu_df['stu_repec'].unique())
+        print(f">>> Fetching {len(handles):,} pages ({len(index):,} stored)")
+        index = crawl(handles, index)
+
+    # Parse stored pages
+    adv_df = stu_df['stu_repec'].apply(lambda h: parse(h, index))
     adv_df['adviser_name'] = adv_df['adviser_name'].str.replace('  ', ' ')
     adv_df = adv_df.replace("-", "").replace("-; -", "")
 
@@ -4,24 +4,69 @@
 universities, before and after deceased faculty members are removed.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import pycountry
-from numpy import where
 from tqdm import tqdm
-from pybliometrics.scopus import AffiliationRetrieval
+from pybliometrics.scopus import AffiliationRetrieval, AuthorRetrieval
 
 from _005_parse_students import write_stats
 
-tqdm.pandas()
-
-
 INSTITUTION_FOLDER = Path("./090_institution_data/")
+AFFILIATION_TABLE = INSTITUTION_FOLDER/"scopus_affiliations.csv"
+AUTHOR_TABLE = Path("./060_identifiers/scopus_authors.csv")
 TARGET_FILE = Path("./117_faculty_lists/hasselback.csv")
+AUTHOR_REGISTRY = Path("./117_faculty_lists/authors.csv")
 FACULTY_FILE = 'https://raw.githubusercontent.com/Michael-E-Rose/Hasselback'\
                'FacultyRoster/master/hasselback.csv'
 
+YEARS = range(2000, 2005)  # Years of faculty lists to keep
+
+
+class AuthorRegistry:
+    """Persistent mapping of Scopus author IDs to dense int32 indices.
+
+    The index of an author is its row in the registry file.  IDs are only
+    ever appended, so indices agree across all stages sharing the file.
+    """
+    def __init__(self, fname=AUTHOR_REGISTRY):
+        self.fname = fname
+        try:
+            ids = pd.read_csv(fname, dtype={"scopus_id": "uint64"})["scopus_id"]
+        except FileNotFoundError:
+            ids = pd.Series([], dtype="uint64")
+        self.ids = ids.to_numpy()
+        self._index = pd.Index(self.ids)
+        self._saved = len(self)
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def decode(self, idx):
+        """Return Scopus IDs of author indices."""
+        return self.ids[np.asarray(idx, dtype="int64")]
+
+    def encode(self, ids, add=True):
+        """Return author indices of Scopus IDs given as strings, floats or
+        integers.  Unknown IDs are appended, or mapped to -1 without `add`.
+        """
+        ids = pd.to_numeric(pd.Series(ids, dtype=object)).to_numpy("uint64")
+        idx = self._index.get_indexer(ids)
+        if add and (idx == -1).any():
+            self.ids = np.concatenate([self.ids, pd.unique(ids[idx == -1])])
+            self._index = pd.Index(self.ids)
+            idx = self._index.get_indexer(ids)
+        return idx.astype("int32")
+
+    def save(self):
+        """Write registry if authors were added."""
+        if len(self) > self._saved:
+            pd.DataFrame({"scopus_id": self.ids}).to_csv(self.fname, index=False)
+            self._saved = len(self)
+
 
 def create_country_map():
     """Create mapping of country names to alpha 2."""
@@ -36,43 +81,142 @@ def create_country_map():
     return country_map
 
 
-def flatten(lst):
-    """Flatten two or more lists."""
-    lst = lst.dropna()
-    return set([e for sl in lst for e in sl if sl])
-
-
 def get_aff_information(aff_id, refresh=False):
-    """Get country and type of affiliation."""
+    """Get name, country and type of affiliation."""
     aff = AffiliationRetrieval(aff_id, refresh=refresh)
-    country = country_map.get(aff.country)
-    if not country:
-        print(aff.country)
-    return pd.Series({"country": country, "type": aff.org_type})
-
-
-def interpolate_faculty(s):
-    """Fill gaps of faculty membership."""
-    # Add empty sets
-    s = s.apply(lambda d: d or set())
-    # Detect missing faculty and add in years between
-    for idx0, last in list(s.items())[2:]:
-        for idx1, current in list(s.items())[:-2]:
+    return {"name": aff.affiliation_name, "org_type": aff.org_type,
+            "country_name": aff.country}
+
+
+def get_author_information(auth_id, refresh=False):
+    """Get given name and surname of author."""
+    au = AuthorRetrieval(auth_id, refresh=refresh)
+    return {"given_name": au.given_name, "surname": au.surname}
+
+
+def interpolate_faculty(roster, years):
+    """Fill gaps of faculty membership: members belong to a department in
+    all `years` between their first and last listing there.
+    """
+    spans = (roster.groupby(["institution", "scopus_id"])["year"]
+                   .agg(["min", "max"]).reset_index())
+    out = []
+    for year in years:
+        mask = (spans["min"] <= year) & (spans["max"] >= year)
+        out.append(spans.loc[mask, ["institution", "scopus_id"]].assign(year=year))
+    return pd.concat(out, ignore_index=True)
+
+
+def lookup_table(ids, fname, retrieve, refresh=False, max_workers=8):
+    """Serve information on Scopus IDs from a local table, retrieving each
+    ID missing in the table only once and concurrently.
+
+    With `refresh` True, all requested IDs are retrieved anew; with an
+    integer, those whose row is older than this number of days.  IDs whose
+    retrieval fails are reported and left missing, to be tried again.
+    """
+    ids = pd.Series(ids).dropna().astype("uint64").unique()
+    try:
+        table = pd.read_csv(fname, index_col="id", dtype={"id": "uint64"},
+                            parse_dates=["retrieved"])
+    except FileNotFoundError:
+        table = pd.DataFrame({"retrieved": pd.Series(dtype="datetime64[ns]")},
+                             index=pd.Index([], dtype="uint64", name="id"))
+    except ValueError:  # Table without retrieval dates
+        table = pd.read_csv(fname, index_col="id", dtype={"id": "uint64"})
+        table["retrieved"] = pd.NaT
+    today = pd.Timestamp.today().normalize()
+    if refresh is True:
+        stale = set(ids)
+    elif refresh:
+        cutoff = today - pd.Timedelta(days=refresh)
+        dates = table["retrieved"].reindex(ids)
+        stale = set(dates.index[~(dates >= cutoff)])
+    else:
+        stale = set(ids) - set(table.index)
+    missing = sorted(stale)
+    if missing:
+        print(f"... retrieving {len(missing):,} IDs ({len(ids):,} requested)")
+
+        def safe_retrieve(i):
             try:
-                new = last.intersection(current)
-            except AttributeError:
-                continue
-            for idx2 in range(idx1+1, idx0):
-                try:
-                    s.loc[idx2].update(new)
-                except KeyError:
-                    continue
-    return s
+                return retrieve(i, refresh=refresh)
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            data = list(tqdm(executor.map(safe_retrieve, missing),
+                             total=len(missing)))
+        failed = {i for i, d in zip(missing, data) if isinstance(d, Exception)}
+        if failed:
+            print(f"... retrieval failed for {len(failed):,} IDs: "
+                  f"{'; '.join(str(i) for i in sorted(failed))}")
+        fetched = [(i, d) for i, d in zip(missing, data) if i not in failed]
+        if fetched:
+            index = pd.Index([i for i, _ in fetched], dtype="uint64", name="id")
+            new = pd.DataFrame([d for _, d in fetched], index=index)
+            new["retrieved"] = today
+            table = pd.concat([table.drop(index, errors="ignore"), new]).sort_index()
+            table = table[[c for c in table.columns if c != "retrieved"]
+                          + ["retrieved"]]
+            table.to_csv(fname, index_label="id", date_format="%Y-%m-%d")
+    return table.reindex(ids)
+
 
+def retrieve_affiliations(aff_ids, refresh=False):
+    """Return name, type and country (alpha 2) of affiliations."""
+    table = lookup_table(aff_ids, AFFILIATION_TABLE, get_aff_information,
+                         refresh=refresh)
+    table["country"] = table["country_name"].map(country_map)
+    unknown = table.loc[table["country"].isna(), "country_name"].dropna()
+    if not unknown.empty:
+        print(f"... unknown countries: {'; '.join(unknown.unique())}")
+    return table
 
-def setfy(x, sep=";"):
-    """Split string into set."""
-    return set(x.strip(sep).split(sep))
+
+def retrieve_authors(auth_ids, refresh=False):
+    """Return given name, surname and full name of authors."""
+    table = lookup_table(auth_ids, AUTHOR_TABLE, get_author_information,
+                         refresh=refresh)
+    table["name"] = table["given_name"].fillna("") + " " + table["surname"]
+    table["name"] = table["name"].str.strip()
+    return table
+
+
+def read_faculty(registry, fname=TARGET_FILE):
+    """Read faculty lists as nested dictionary of years, Scopus IDs of
+    institutions and sets of author indices of their members.
+    """
+    df = (pd.read_csv(fname, index_col="Scopus", dtype=str)
+            .drop(columns="country").fillna(""))
+    deps = df.index.astype("uint64").tolist()
+    lookup = {}
+    for year, col in df.items():
+        members = col.set_axis(deps).str.split(";").explode()
+        members = members[members != ""]
+        idx = pd.Series(registry.encode(members), index=members.index)
+        groups = idx.groupby(level=0).agg(lambda s: set(s.tolist()))
+        lookup[year] = {dep: groups.get(dep, set()) for dep in deps}
+    return lookup
+
+
+def read_roster(registry, fname=FACULTY_FILE):
+    """Read Hasselback files as long table of institution, year and faculty
+    member, with institutions interned as integers and faculty members as
+    author indices of `registry`.
+    """
+    df = pd.read_csv(fname, dtype=str)
+    roster = []
+    for c in sorted([c for c in df.columns if c.endswith("institution")]):
+        subset = df[[c, "scopus_id"]].dropna()
+        subset.columns = ["institution", "scopus_id"]
+        roster.append(subset.assign(year=int(c[1:5])))
+    roster = pd.concat(roster, ignore_index=True)
+    roster["scopus_id"] = roster["scopus_id"].str.strip(";").str.split(";")
+    roster = roster.explode("scopus_id").drop_duplicates()
+    roster["institution"], institutions = pd.factorize(roster["institution"],
+                                                      sort=True)
+    roster["scopus_id"] = registry.encode(roster["scopus_id"])
+    return roster, institutions
 
 
 country_map = create_country_map()
@@ -80,33 +224,19 @@ country_map = create_country_map()
 
 def main():
     # Read Hasselback files
-    df = pd.read_csv(FACULTY_FILE, dtype=str)
-    df["scopus_id"] = df["scopus_id"] + ";"
-    hass = pd.DataFrame()
-    for c in sorted([c for c in df.columns if c.endswith("institution")]):
-        year = c[1:5]
-        subset = df[~df[c].isnull()].copy()
-        group = subset.groupby([c])["scopus_id"].sum().to_frame()
-        group["scopus_id"] = group["scopus_id"].str.rstrip(";").apply(setfy)
-        group = group.rename(columns={"scopus_id": year})
-        if year in hass.columns:
-            group = pd.concat([hass[year], group], axis=1, sort=True)
-            group = group.apply(flatten, axis=1).to_frame(name=year)
-            hass = hass.drop(columns=year)
-        hass = hass.join(group, how="outer")
-
-    # Use integer column names
-    rename = {y: int(y) for y in sorted(hass.columns)}
-    hass = hass.rename(columns=rename)
-    hass = hass[sorted(hass.columns)]
+    registry = AuthorRegistry()
+    roster, institutions = read_roster(registry)
+    registry.save()
 
     # Interpolate faculty members
-    for y in hass.columns:
-        hass[y] = where(hass[y].isnull(), None, hass[y])
-    hass = hass.apply(interpolate_faculty, axis=1)
-    hass = hass[range(2000, 2005)]
-    mask_empty = hass.applymap(len).sum(axis=1) == 0
-    hass = hass[~mask_empty]
+    members = interpolate_faculty(roster, YEARS)
+    members["institution"] = institutions[members["institution"].to_numpy()]
+    members["scopus_id"] = registry.decode(members["scopus_id"]).astype(str)
+    members = members.sort_values(["institution", "year", "scopus_id"])
+    hass = (members.groupby(["institution", "year"])["scopus_id"]
+                   .agg(";".join).unstack().fillna("")
+                   .rename_axis(columns=None))
+    hass = hass.reindex(columns=YEARS, fill_value="")
     years = hass.columns
 
     # Add Scopus information of institutions
@@ -117,8 +247,9 @@ def main():
     print(hass[hass["Scopus"].isna()].index)
     hass = hass.dropna(subset="Scopus")
     hass["Scopus"] = hass["Scopus"].astype("uint64")
-    info = hass["Scopus"].progress_apply(get_aff_information)
-    hass = hass.join(info)
+    info = retrieve_affiliations(hass["Scopus"])
+    info = info[["country", "org_type"]].rename(columns={"org_type": "type"})
+    hass = hass.join(info, on="Scopus")
 
     # Applying corrections to Scopus' 'coll' classification
     coll_mask = hass.index.str.find("College") > -1
@@ -135,12 +266,10 @@ def main():
 
     # Count all faculty members
     hass = hass.set_index(["Scopus", "country"])
-    all_members = set()
-    for c in hass.columns:
-        all_members.update({p for sl in hass[c].dropna().to_numpy() for p in sl})
+    all_members = set(";".join(hass[years].to_numpy().ravel()).split(";"))
+    all_members.discard("")
 
     # Write out
-    hass = hass.fillna("").applymap(lambda s: ";".join(sorted(s)))
     hass.to_csv(TARGET_FILE)
     stats = {"N_of_Hasselback_Dep": hass.shape[0],
              "N_of_Hasselback_Fac": len(all_members)}
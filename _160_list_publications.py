@@ -8,8 +8,11 @@ import pandas as pd
 from pybliometrics.scopus import ScopusSearch
 from tqdm import tqdm
 
+from ledger import Ledger
+
 ADVISERID_FILE = Path("./060_identifiers/advisers.csv")
 TARGET_FILE = Path("./160_publication_list/advisers_committee.csv")
+LEDGER_FILE = Path("./160_publication_list/ledger")
 
 CUTOFF = 2016
 
@@ -45,19 +48,27 @@ def main():
           "committee)")
 
     # List Publications
-    out = {}
-    for auth_id in tqdm(scopus_ids):
+    ledger = Ledger(LEDGER_FILE)
+    todo = [a for a in scopus_ids if a not in ledger]
+    print(f"... {len(ledger):,} researchers done, {len(todo):,} to go")
+    for auth_id in tqdm(todo):
         q = f"AU-ID({auth_id})"
         try:
             eids, sources, years = perform_query(q)
         except Exception as e:
             print(type(e), auth_id)
+            continue
         if not eids or not sources or not years:
             print(f"{auth_id} has missing information")
+            ledger.record(auth_id)
             continue
         sources = [s or "-" for s in sources]  # Replace missing journal names
-        out[auth_id] = {"eids": "|".join(eids), "sources": "|".join(sources),
-                        "years": "|".join(years)}
+        ledger.record(auth_id, {"eids": "|".join(eids),
+                                "sources": "|".join(sources),
+                                "years": "|".join(years)})
+    ledger.close()
+    print(">>>", ledger.status())
+    out = {a: ledger.done[str(a)] for a in scopus_ids if ledger.done.get(str(a))}
 
     # Write out
     df = pd.DataFrame(out).T.sort_index()
@@ -4,47 +4,76 @@
 publication count, yearly citations and Euclidean index of citations.
 
 You need a special API key by Scopus to access the citation view.
+
+Metrics are computed on arrays: authors and documents are linked through a
+sparse matrix, and yearly citations of documents form a dense
+document-year matrix, such that all author-year metrics follow from matrix
+products and cumulative sums.
 """
 
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from numpy import inf, nan
-from scholarmetrics import euclidean
 from pybliometrics.scopus import CitationOverview
+from scipy import sparse
 from tqdm import tqdm
 
 from _160_list_publications import CUTOFF
+from ledger import Ledger
 
 SOURCE_FILE = Path("./160_publication_list/advisers_committee.csv")
 TARGET_FILE = Path("./161_author_metrics/metrics.csv")
-
-
-def compute_euclid(df):
-    """Return yearly Euclidean index except when all entries are nan."""
-    return df.dropna(how="all", axis=1).cumsum(axis=1).apply(euclidean)
-
-
-def compute_fixed_growth(df, begin, end):
-    """Compute growth rate between two fixed years."""
-    try:
-        lower = int(df.loc[df["year"] == begin, "adv_citestock"].values[0])
-        upper = int(df.loc[df["year"] == end, "adv_citestock"].values[0])
-        return (upper-lower)/lower
-    except IndexError:
-        return nan
-    except ZeroDivisionError:
-        return 0
-
-
-def compute_growth(df, shift):
-    """Compute growth rate relative to value `shift` periods away."""
-    return df.pct_change(periods=shift)
-
-
-def compute_rolling_change(df, window):
-    """Compute percentage change to average of previous values."""
-    return df/df.rolling(window=window, min_periods=0).mean().shift(window-1)
+LEDGER_FILE = Path("./161_author_metrics/ledger")
+
+
+def compute_fixed_growth(stock, years, begin, end):
+    """Compute growth rate of each row between two fixed years, and 0 if
+    either year is missing or the initial value is 0.
+    """
+    if begin not in years or end not in years:
+        return np.zeros(stock.shape[0])
+    lower = stock[:, years.index(begin)]
+    upper = stock[:, years.index(end)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = (upper-lower)/lower
+    return np.where(np.isfinite(growth), growth, 0)
+
+
+def compute_growth(arr, shift):
+    """Compute growth rate of each column relative to the column `shift`
+    periods before, with nan instead of infinite values.
+    """
+    out = np.full(arr.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[:, shift:] = arr[:, shift:]/arr[:, :-shift] - 1
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+def compute_metrics(authors, cites, available, years):
+    """Compute yearly citation metrics from the sparse author-document
+    matrix `authors`, and the document-year matrices `cites` of citations
+    and `available` of availability of citation information.
+
+    A year is covered for an author if at least one document has citation
+    information in that year.  The Euclidean index is the square root of
+    the sum of squared citation stocks of the author's documents.
+    """
+    covered = (authors @ available.astype("int64")) > 0
+    flow = authors @ cites
+    stock = np.cumsum(flow, axis=1)
+    doc_stock = np.cumsum(cites, axis=1) * available
+    euclid = np.sqrt(authors @ doc_stock.astype("float64")**2)
+    flow_obs = np.where(covered, flow, np.nan)
+    stock_obs = np.where(covered, stock, np.nan)
+    fixed = compute_fixed_growth(stock_obs, years, 1996, 1999)
+    return covered, {
+        "adv_euclid": euclid, "adv_citestock": stock, "citeflow": flow,
+        "citeflow_growth1": compute_growth(flow_obs, 1),
+        "citestock_growth1": compute_growth(stock_obs, 1),
+        "citestock_growth3": compute_growth(stock_obs, 3),
+        "citestock_growth9699": np.repeat(fixed[:, None], len(years), axis=1)}
 
 
 def get_yearly_citations(eid, pubyear, refresh=False):
@@ -57,9 +86,32 @@ def get_yearly_citations(eid, pubyear, refresh=False):
     return {y: int(c) for y, c in co.cc[0]}
 
 
-def nan_preserving_sum(df):
-    """Sum values except when all entries are nan."""
-    return df.dropna(how="all", axis=1).fillna(0).sum(axis=0)
+def make_author_matrix(eids, docs):
+    """Build sparse author-document matrix counting how often a document
+    is listed for each author.
+    """
+    codes, authors = pd.factorize(eids.index, sort=True)
+    cols = docs.get_indexer(eids.values)
+    matrix = sparse.csr_matrix((np.ones(len(cols), dtype="int64"), (codes, cols)),
+                               shape=(len(authors), len(docs)))
+    return authors, matrix
+
+
+def make_citation_matrix(yearly_cites, cutoff=CUTOFF):
+    """Build dense document-year matrices of citations and of availability
+    of citation information, for years before `cutoff`.
+    """
+    docs = pd.Index(sorted(yearly_cites))
+    entries = [(i, y, c) for i, doc in enumerate(docs)
+               for y, c in yearly_cites[doc].items() if y < cutoff]
+    rows, years, counts = zip(*entries) if entries else ((), (), ())
+    all_years = sorted(set(years))
+    cols = np.searchsorted(all_years, years)
+    cites = np.zeros((len(docs), len(all_years)), dtype="int64")
+    cites[rows, cols] = counts
+    available = np.zeros(cites.shape, dtype=bool)
+    available[rows, cols] = True
+    return docs, all_years, cites, available
 
 
 def main():
@@ -81,53 +133,32 @@ def main():
     pubyears = [pubyear for sl in df["years"] for pubyear in sl]
     eid_years = set(zip(eids, pubyears))
     print(f">>> Searching yearly citation counts for {len(eid_years):,} documents...")
-    yearly_cites = {eid: get_yearly_citations(eid, pub_year) for
-                    eid, pub_year in tqdm(eid_years)}
-    print(">>> Computing citation counts")
-    yearly_cites = pd.DataFrame(yearly_cites)
-    yearly_cites = yearly_cites[yearly_cites.index < CUTOFF].T
-    yearly_cites = yearly_cites[sorted(yearly_cites.columns)]
-    eids = df["eids"].explode().to_frame("eid").reset_index()
-    eid_cites = (eids.join(yearly_cites, on="eid")
-                     .drop(columns="eid").set_index("adv_scopus"))
-    grouped = eid_cites.groupby(eid_cites.index)
-    cites = grouped.apply(nan_preserving_sum)
-    cites = (cites.reset_index()
-                  .rename(columns={"level_1": "year", 0: "citeflow"}))
-    cites["adv_citestock"] = cites.groupby('adv_scopus')[["citeflow"]].cumsum()
-    cites = cites.astype("uint64")
-
-    # Citation growth measures
-    print(">>> Computing citation growth measures")
-    grouped_cites = cites.groupby("adv_scopus")
-    # Growth of flow compared to average of previous years
-    cites["citeflow_growth1"] = grouped_cites["citeflow"].pct_change()
-    # Growth of stock compared previous years of different length
-    for period in (1, 3):
-        label = f"citestock_growth{period}"
-        cites[label] = grouped_cites["adv_citestock"].apply(
-            lambda df: compute_growth(df, period))
-    cites = cites.replace([-inf, inf], nan)
-    # Growth of stock and flow for entire periods
-    fixed = grouped_cites.apply(lambda df: compute_fixed_growth(df, 1996, 1999))
-    fixed = fixed.to_frame("citestock_growth9699")
-    # Combine
-    cites = cites.join(fixed, on="adv_scopus").fillna(0)
-    cites = cites[sorted(cites.columns)]
-
-    # Euclidean index of citations
-    print(">>> Computing Euclidean indices of citation")
-    euclid = grouped.apply(compute_euclid)
-    euclid = (euclid.reset_index()
-                    .rename(columns={"level_1": "year", 0: "adv_euclid"}))
+    ledger = Ledger(LEDGER_FILE)
+    todo = sorted((eid, y) for eid, y in eid_years if eid not in ledger)
+    print(f"... {len(ledger):,} documents done, {len(todo):,} to go")
+    for eid, pub_year in tqdm(todo):
+        ledger.record(eid, get_yearly_citations(eid, pub_year))
+    ledger.close()
+    print("...", ledger.status())
+    print(">>> Computing citation metrics")
+    yearly_cites = {eid: {int(y): c for y, c in ledger.done[eid].items()}
+                    for eid, _ in eid_years}
+    docs, years, cites, available = make_citation_matrix(yearly_cites)
+    authors, matrix = make_author_matrix(df["eids"].explode(), docs)
+    covered, metrics = compute_metrics(matrix, cites, available, years)
+    rows, cols = np.nonzero(covered)
+    out = pd.DataFrame({"adv_scopus": authors[rows],
+                        "year": np.array(years)[cols]})
+    out["adv_euclid"] = metrics.pop("adv_euclid")[rows, cols]
 
     # Merge data
     print(">>> Merging data")
-    out = euclid.merge(first, "left", on="adv_scopus")
+    out = out.merge(first, "left", on="adv_scopus")
     out["adv_experience"] = out["year"] - out["first_pub_year"].astype(int)
     out = out.drop(columns="first_pub_year")
-    out = (out.merge(cites, "left", on=["adv_scopus", "year"])
-              .sort_values(['adv_scopus', 'year']))
+    for col in sorted(metrics):
+        out[col] = metrics[col][rows, cols]
+    out = out.fillna(0)
 
     # Write out
     print(">>> Writing out")
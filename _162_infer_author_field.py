@@ -14,15 +14,16 @@ START = 1995
 END = 2006
 
 
-def find_mode(s, seed=42):
-    """Return mode or random selection in case of equal frequency."""
-    import random
-    random.seed(seed)
-    mode = s.mode()
-    if len(mode) == 1:
-        return mode.iloc[0]
-    else:
-        return random.choice(mode)[0]
+def find_mode(df, by="adv_scopus", col="field"):
+    """Return most frequent value of `col` for each group in `by`.
+
+    Ties are broken by a stable hash of group and value, such that the
+    selection does not depend on the order of the data.
+    """
+    counts = df.groupby([by, col]).size().rename("n").reset_index()
+    counts["hash"] = pd.util.hash_pandas_object(counts[[by, col]], index=False)
+    counts = counts.sort_values([by, "n", "hash"], ascending=[True, False, True])
+    return counts.drop_duplicates(by).set_index(by)[col]
 
 
 def main():
@@ -56,12 +57,7 @@ def main():
     # Write out
     print(">>> Writing out")
     main_f = df[df["field"] != "Econ"]
-    main_f = (main_f.dropna(subset=["field"])
-                    .groupby(["adv_scopus"])["field"].apply(find_mode)
-                    .apply(pd.Series).unstack()
-                    .reset_index(level=0, drop=True)
-                    .sort_index()
-                    .dropna())
+    main_f = find_mode(main_f.dropna(subset=["field"]))
     main_f.name = "adv_jel"
     main_f.to_csv(TARGET_FOLDER/"main.csv")
 
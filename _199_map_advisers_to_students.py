@@ -2,13 +2,13 @@
 # Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
 """Maps students to their advisers and committee members."""
 
-import random
 from collections import Counter
+from functools import partial
 from pathlib import Path
-from random import choices
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 from numpy import arange
 from tqdm import tqdm
@@ -23,6 +23,12 @@ FIELD_FILE = Path("./162_author_fields/main.csv")
 TARGET_FOLDER = Path("./199_adviser-student_map/")
 OUTPUT_FOLDER = Path("./990_output/")
 
+N_DRAWS = 500  # No. of random states with same student-per-adviser distribution
+N_FIELD_DRAWS = 100  # No. of random states with advisers from same field
+SEED = 0
+CHUNK_SIZE = 1_000  # No. of draws generated at once from one seed stream
+EXPORT_CSV = False  # Additionally write one CSV file per draw
+
 font = {'family': 'serif', 'serif': 'Utopia', 'size': 15}
 mpl.use("Agg")
 mpl.rc('font', **font)
@@ -53,6 +59,17 @@ def aggregate(df):
     return df
 
 
+def export_draws(scheme, folder=TARGET_FOLDER):
+    """Write one CSV file with adviser-student pairs per draw."""
+    draws, students, advisers = read_draws(scheme, folder=folder)
+    for i, draw in tqdm(enumerate(draws), total=draws.shape[0]):
+        mask = draw >= 0
+        df = pd.DataFrame({"random": advisers[draw[mask]],
+                           "stu_id": students[mask]})
+        df = df.sort_values("stu_id")
+        df.to_csv(folder/f"random_{scheme}{i:03d}.csv", index=False)
+
+
 def make_histogram(counter, fname, width=1):
     """Save a histogram made from Counter object."""
     counted_values = Counter(counter.values())
@@ -77,6 +94,127 @@ def make_histogram(counter, fname, width=1):
     plt.close()
 
 
+def read_draws(scheme, draws=None, folder=TARGET_FOLDER):
+    """Read matrix of random assignments (draws x students) of `scheme`
+    memory-mapped, together with the student and adviser IDs that its
+    columns and values refer to.  Use `draws` to select specific draws.
+    """
+    matrix = np.load(folder/f"random_{scheme}.npy", mmap_mode="r")
+    if draws is not None:
+        matrix = matrix[draws]
+    students = pd.read_csv(folder/f"random_{scheme}_students.csv")["stu_id"]
+    advisers = pd.read_csv(folder/"random_advisers.csv")["adv_scopus"]
+    return matrix, pd.Index(students), advisers.to_numpy()
+
+
+def read_pool(scheme, folder=TARGET_FOLDER):
+    """Read students and advisers from which assignments of `scheme` are
+    drawn, together with a function `sampler(n_draws, seed)` returning
+    new draws.
+    """
+    students = pd.read_csv(folder/f"random_{scheme}_students.csv")
+    advisers = pd.read_csv(folder/"random_advisers.csv")
+    if scheme == "field":
+        sampler = partial(sample_field, advisers["adv_jel"].to_numpy(),
+                          students["stu_jel"].to_numpy())
+    else:
+        sampler = partial(sample_distribution, advisers["n_students"].to_numpy(),
+                          students.shape[0])
+    return (pd.Index(students["stu_id"]), advisers["adv_scopus"].to_numpy(),
+            sampler)
+
+
+def sample_distribution(sizes, n_students, n_draws, seed=SEED,
+                        chunk_size=CHUNK_SIZE):
+    """Randomly assign students to advisers such that the distribution of
+    students per adviser equals `sizes`.
+
+    In each draw, a permutation of the advisers decides which adviser
+    receives which group size, and a single permutation of the student
+    indices is sliced into groups of these sizes.  Students beyond the
+    sum of `sizes` remain unassigned (-1); if the sizes exceed the number
+    of students, the smallest groups are shortened.  Chunks of draws come
+    from independent streams spawned from one `SeedSequence`.
+
+    Returns an array of shape (n_draws, n_students) with adviser indices.
+    """
+    sizes = np.sort(np.asarray(sizes))[::-1]
+    n_advisers = len(sizes)
+    slots = np.repeat(arange(n_advisers), sizes)[:n_students]
+    out = np.full((n_draws, n_students), -1, dtype="int32")
+    n_chunks = -(-n_draws // chunk_size)
+    streams = np.random.SeedSequence(seed).spawn(n_chunks)
+    for i, stream in enumerate(streams):
+        rng = np.random.default_rng(stream)
+        rows = arange(i*chunk_size, min((i+1)*chunk_size, n_draws))
+        k = len(rows)
+        adv_perm = rng.random((k, n_advisers)).argsort(axis=1).astype("int32")
+        stu_perm = rng.random((k, n_students)).argsort(axis=1)[:, :len(slots)]
+        out[rows[:, None], stu_perm] = adv_perm[:, slots]
+    return out
+
+
+def sample_field(adv_fields, stu_fields, n_draws, seed=SEED,
+                 chunk_size=CHUNK_SIZE):
+    """Randomly assign each student an adviser from the same field.
+
+    Advisers are sorted by field such that each field corresponds to a
+    contiguous range of adviser positions, from which a uniformly drawn
+    offset picks the adviser for each student and draw.  Students in fields
+    without advisers remain unassigned (-1).
+
+    Returns an array of shape (n_draws, n_students) with positions in
+    `adv_fields`.
+    """
+    adv_fields = pd.Series(np.asarray(adv_fields, dtype=object))
+    known = adv_fields.dropna().astype(str).sort_values(kind="stable")
+    order = known.index.to_numpy()
+    known = known.to_numpy().astype(str)
+    stu_fields = np.asarray(stu_fields, dtype=object).astype(str)
+    start = np.searchsorted(known, stu_fields, side="left")
+    size = np.searchsorted(known, stu_fields, side="right") - start
+    cols = np.flatnonzero(size > 0)
+    out = np.full((n_draws, len(stu_fields)), -1, dtype="int32")
+    n_chunks = -(-n_draws // chunk_size)
+    streams = np.random.SeedSequence(seed).spawn(n_chunks)
+    for i, stream in enumerate(streams):
+        rng = np.random.default_rng(stream)
+        rows = arange(i*chunk_size, min((i+1)*chunk_size, n_draws))
+        offset = (rng.random((len(rows), len(cols))) * size[cols]).astype(int)
+        out[rows[:, None], cols] = order[start[cols] + offset]
+    return out
+
+
+def summarize_draws(draws, n_advisers, chunk_size=CHUNK_SIZE):
+    """Compute the largest number of students per adviser and the number
+    of advisers with more than one student for each draw.
+    """
+    n_max = np.empty(draws.shape[0], dtype="int64")
+    n_multiple = np.empty(draws.shape[0], dtype="int64")
+    for start in range(0, draws.shape[0], chunk_size):
+        chunk = draws[start:start+chunk_size]
+        rows = arange(chunk.shape[0])[:, None] * n_advisers + chunk
+        counts = np.bincount(rows[chunk >= 0],
+                             minlength=chunk.shape[0]*n_advisers)
+        counts = counts.reshape(chunk.shape[0], n_advisers)
+        n_max[start:start+chunk_size] = counts.max(axis=1)
+        n_multiple[start:start+chunk_size] = (counts > 1).sum(axis=1)
+    return n_max, n_multiple
+
+
+def write_draws(scheme, draws, students, folder=TARGET_FOLDER):
+    """Write matrix of random assignments of `scheme` with student IDs
+    and, if `students` is a DataFrame, further student information.
+    """
+    np.save(folder/f"random_{scheme}.npy", draws.astype("int32"))
+    if isinstance(students, pd.Index):
+        students = pd.DataFrame(index=students)
+    students = students.rename_axis("stu_id").reset_index()
+    students.to_csv(folder/f"random_{scheme}_students.csv", index=False)
+    if EXPORT_CSV:
+        export_draws(scheme, folder)
+
+
 def main():
     # Manually collected advisers
     manual_cols = ["stu_id", "adviser_name", "commitee_members", "source"]
@@ -132,70 +270,38 @@ def main():
              'N_of_advisers': len(adviser_counter)}
     write_stats(stats)
 
+    # Pool of advisers, which the draws of all schemes refer to
+    advisers = list(adviser_counter.keys())
+    fields = pd.read_csv(FIELD_FILE, index_col="adv_scopus")
+    fields.index = fields.index.astype(str)
+    pool = pd.DataFrame({"adv_scopus": advisers,
+                         "n_students": list(adviser_counter.values())})
+    pool["adv_jel"] = pool["adv_scopus"].map(fields["adv_jel"])
+    pool.to_csv(TARGET_FOLDER/"random_advisers.csv", index=False)
+
     # Randomize with same student-per-adviser distribution
-    distribution = Counter(adviser_counter.values())
     students = df.index
-    advisers = list(adviser_counter.keys())
-    n_max = max(distribution.keys())
-    max_adv = [a for a, v in adviser_counter.items() if v == n_max][0]
-    combs = []
-    print(">>> Creating random states for each adviser as most common adviser")
-    for a in tqdm(advisers):
-        if a == max_adv:
-            continue
-        temp_advisers = advisers.copy()
-        temp_advisers.remove(a)
-        temp_students = students.copy()
-        picks = choices(temp_students, k=n_max)
-        new = [(a, p) for p in picks]
-        temp_students = temp_students.drop(picks)
-        for size, n_advisers in distribution.items():
-            if size == 1 or size == n_max:
-                continue
-            for idx in range(n_advisers):
-                new_a = random.choice(temp_advisers)
-                temp_advisers.remove(new_a)
-                picks = choices(temp_students, k=size)
-                temp_students = temp_students.drop(picks)
-                new.extend((new_a, p) for p in picks)
-        # Finalize
-        combs.append(new)
-    # Write out
-    print("... picking 500 states at random:")
-    for i, assignments in tqdm(enumerate(choices(combs, k=500))):
-        fname = TARGET_FOLDER/f"random_distribution{i:03d}.csv"
-        df = pd.DataFrame(assignments, columns=["random", "stu_id"])
-        df = df.sort_values("stu_id")
-        df.to_csv(fname, index=False)
+    print(f">>> Creating {N_DRAWS:,} random states with the same "
+          "student-per-adviser distribution")
+    draws = sample_distribution(list(adviser_counter.values()), len(students),
+                                N_DRAWS)
+    write_draws("distribution", draws, students)
 
     # Randomize within field
-    adv_field = pd.DataFrame(index=advisers)
-    adv_field.index.name = "adv_scopus"
-    fields = pd.read_csv(FIELD_FILE, index_col="adv_scopus")
-    fields.index = fields.index.astype(str)
-    adv_field = adv_field.join(fields).dropna().reset_index()
-    advisers_by_field = adv_field.groupby("adv_jel")["adv_scopus"].unique()
     stu_field = stu_data[["stu_jel"]]
-    students_by_field = (stu_field.reset_index()
-                                  .groupby("stu_jel")["stu_id"].unique())
     print(">>> Distribution of no. of students and advisers per field:")
-    counts = students_by_field.apply(len).to_frame("student")
-    counts["adviser"] = advisers_by_field.apply(len)
+    counts = stu_field["stu_jel"].value_counts().to_frame("student")
+    counts["adviser"] = pool["adv_jel"].value_counts()
+    counts = counts.dropna().astype(int).sort_index()
     counts["ratio"] = counts["student"] / counts["adviser"]
     print(counts)
 
     # Randomize student-adviser assignment based on field (JEL code)
-    stu_field = stu_field.join(advisers_by_field, on="stu_jel")
-    stu_field = stu_field.dropna(subset=["adv_scopus"])
-    n_max = []
-    n_multiple = []
-    print(f">>> Randomizing assignments 100 times...")
-    for i in tqdm(range(0, 100)):
-        stu_field["random"] = stu_field["adv_scopus"].apply(random.choice)
-        stu_field[["random"]].to_csv(TARGET_FOLDER/f"random_field{i:03d}.csv")
-        counts = stu_field["random"].value_counts()
-        n_max.append(counts[0])
-        n_multiple.append((counts > 1).sum())
+    stu_field = stu_field[stu_field["stu_jel"].isin(counts.index)]
+    print(f">>> Randomizing assignments {N_FIELD_DRAWS:,} times...")
+    draws = sample_field(pool["adv_jel"], stu_field["stu_jel"], N_FIELD_DRAWS)
+    write_draws("field", draws, stu_field)
+    n_max, n_multiple = summarize_draws(draws, len(advisers))
     print(f"... found between {min(n_multiple)} and {max(n_multiple)} "
           "assignments whose adviser has more than 1 student")
     print(f"... most common adviser has between {min(n_max)} and {max(n_max)} "
@@ -14,6 +14,7 @@ from pybliometrics.scopus import ScopusSearch
 from tqdm import tqdm
 
 from _005_parse_students import write_stats
+from _117_get_faculty_lists import AuthorRegistry
 
 SOURCES_FILE = Path("./060_identifiers/CombesLinnemer.csv")
 METRICS_FILE = Path("./161_author_metrics/metrics.csv")
@@ -76,6 +77,13 @@ def giant(G):
     return G.subgraph(nodes).copy()
 
 
+def read_network(fname, registry):
+    """Read network with nodes relabelled to author indices of `registry`."""
+    G = nx.read_gexf(fname)
+    nodes = list(G.nodes())
+    return nx.relabel_nodes(G, dict(zip(nodes, registry.encode(nodes).tolist())))
+
+
 def main():
     # Read list of sources
     df = pd.read_csv(SOURCES_FILE).dropna(subset=["scopus_id"])
@@ -102,6 +110,7 @@ def main():
 
     # Generate networks
     print(">>> Generating networks...")
+    registry = AuthorRegistry()
     out = pd.DataFrame()
     for net_year in range(min_year, max_year+1+LEAD_PERIOD):
         print(f"... using publications for {net_year}:")
@@ -127,6 +136,7 @@ def main():
         G = G.subgraph(active)
         ouf = (TARGET_FOLDER/str(net_year)).with_suffix(".gexf")
         nx.write_gexf(G, ouf)
+        registry.encode(list(G.nodes()))
 
         # Network statistics
         if net_year <= max_year+1:
@@ -137,6 +147,7 @@ def main():
 
     # Write global analysis
     print(">>> Finishing up")
+    registry.save()
     out = out[s.index]
     col_tuples = [tuple(c.split()) for c in out.columns]
     out.columns = pd.MultiIndex.from_tuples(col_tuples)
@@ -14,11 +14,14 @@ from pybliometrics.scopus.exception import ScopusServerError, Scopus404Error
 from requests.exceptions import ReadTimeout
 from tqdm import tqdm
 
+from _117_get_faculty_lists import AuthorRegistry
 from _206_build_coauthor_networks import _types, get_network_years,\
     DISCOUNT_FACTOR, INACTIVE_PERIOD, PUBLICATION_LAG
+from ledger import Ledger
 
 SOURCES_FILE = Path("./060_identifiers/CombesLinnemer.csv")
 TARGET_FOLDER = Path("./211_citation_networks/")
+LEDGER_FILE = TARGET_FOLDER/"ledger"
 
 
 def get_cited_authors(eid, refresh=False):
@@ -70,13 +73,14 @@ def main():
     combs = list(product(sources, period))
     print(f">>> Obtaining publications for up to {len(combs):,} volumes of "
           f"{n_journals} different source IDs...")
-    all_links = defaultdict(lambda: list())
+    ledger = Ledger(LEDGER_FILE)
     for source_id, year in tqdm(combs):
         q = f"SOURCE-ID({source_id}) AND PUBYEAR IS {year}"
-        if q in done:
+        if q in ledger:
             continue
         s = ScopusSearch(q, refresh=False)
         docs = s.results or []
+        citations = []
         for p in docs:
             if p.subtype not in _types:
                 continue
@@ -84,12 +88,20 @@ def main():
                 citing_authors = p.author_ids.split(";")
             except AttributeError:
                 continue
-            auths = get_cited_authors(p.eid)
+            citations.append((citing_authors, get_cited_authors(p.eid)))
+        ledger.record(q, {"year": year, "citations": citations})
+    ledger.close()
+    print("...", ledger.status())
+    all_links = defaultdict(lambda: list())
+    for source_id, year in combs:
+        entry = ledger.done[f"SOURCE-ID({source_id}) AND PUBYEAR IS {year}"]
+        for citing_authors, auths in entry["citations"]:
             for cited_authors in auths:
                 all_links[year].extend(list(product(citing_authors, cited_authors)))
 
     # Generate networks
     print(">>> Generating networks...")
+    registry = AuthorRegistry()
     for net_year in tqdm(range(min_year, max_year + 1)):
         # Weigh edges
         edges = Counter()
@@ -111,6 +123,8 @@ def main():
         G = G.subgraph(active)
         ouf = (TARGET_FOLDER/str(net_year)).with_suffix(".gexf")
         nx.write_gexf(G, ouf)
+        registry.encode(list(G.nodes()))
+    registry.save()
 
 
 if __name__ == '__main__':
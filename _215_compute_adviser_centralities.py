@@ -12,7 +12,8 @@ import pandas as pd
 from tqdm import tqdm
 
 from _005_parse_students import write_stats
-from _206_build_coauthor_networks import giant
+from _117_get_faculty_lists import AuthorRegistry
+from _206_build_coauthor_networks import giant, read_network
 
 COAUTHOR_FOLDER = Path("./206_coauthor_networks")
 TARGET_FOLDER = Path("./215_adviser_centralities")
@@ -69,12 +70,14 @@ def read_adviser_ids(col='adv_scopus'):
     return sorted(advisers)
 
 
-def read_deceased():
-    """Read file with deceased authors and format."""
+def read_deceased(registry):
+    """Read file with deceased authors and format, indexed by their author
+    indices of `registry`.
+    """
     deaths = pd.read_csv(Path("075_deceased_authors/deceased.csv"),
                          index_col="scopus_id")
-    deaths.index = deaths.index.astype(str)
     deaths = deaths[deaths["death"] != "0"]
+    deaths.index = registry.encode(deaths.index)
     deaths["death"] = pd.to_datetime(deaths["death"])
     return deaths
 
@@ -92,8 +95,9 @@ def winsorize(s, level=0.01):
 
 def main():
     files = sorted(COAUTHOR_FOLDER.glob("*.gexf"))
-    advisers = set(read_adviser_ids())
-    deaths = read_deceased()
+    registry = AuthorRegistry()
+    advisers = set(registry.encode(read_adviser_ids()).tolist())
+    deaths = read_deceased(registry)
 
     year_cutoff = 2005
     adv_network = set()
@@ -112,7 +116,7 @@ def main():
 
         # Compute centralities
         start = datetime.now().replace(microsecond=0)
-        H = nx.read_gexf(file)
+        H = read_network(file, registry)
         dfs = []
         cur_advisers = advisers.intersection(H.nodes())
         for adv in tqdm(cur_advisers):
@@ -167,6 +171,7 @@ def main():
 
         # Write centralities
         fname = (TARGET_FOLDER/f"coauthor_{year}").with_suffix(".csv")
+        df.index = registry.decode(df.index)
         df = df.sort_index()
         df.to_csv(fname, index_label="node", encoding="utf8")
         end = datetime.now().replace(microsecond=0)
@@ -14,6 +14,8 @@ import networkx as nx
 from tqdm import tqdm
 
 from _005_parse_students import write_stats
+from _117_get_faculty_lists import AuthorRegistry, read_faculty
+from _206_build_coauthor_networks import read_network
 from _215_compute_adviser_centralities import read_deceased
 
 ADVISER_FILE = Path("./199_adviser-student_map/actual.csv")
@@ -54,10 +56,10 @@ def measure_faculty_distance(G, adv, faculty, year):
     return pd.Series(out)
 
 
-def melt_and_format(dist):
+def melt_and_format(dist, registry):
     """Melt distance matrix DataFrame and format columns."""
     out = pd.DataFrame.from_dict(dist).T.astype("float16")
-    out.index.name = "adviser"
+    out.index = pd.Index(registry.decode(out.index), name="adviser")
     out = (out.reset_index()
               .melt(id_vars="adviser", var_name="university", value_name="dist")
               .set_index(["university", "adviser"]))
@@ -66,19 +68,17 @@ def melt_and_format(dist):
 
 def main():
     print(">>> Reading files")
+    registry = AuthorRegistry()
     # Advisers with students
     df = pd.read_csv(ADVISER_FILE, usecols=["stu_id", "adv_scopus"])
-    df = df.dropna(subset=['adv_scopus'])
-    df["adv_scopus"] = df["adv_scopus"].str.split(";")
-    all_adv = sorted(set([str(a) for sl in df['adv_scopus'] for a in sl]))
+    advisers = df["adv_scopus"].dropna().str.split(";").explode()
+    all_adv = sorted(set(registry.encode(advisers).tolist()))
 
     # Deceased authors
-    deaths = read_deceased()
+    deaths = read_deceased(registry)
 
     # Faculty-keyed dictionary
-    hasselback = pd.read_csv(FACULTY_FILE, index_col="Scopus").drop(columns="country")
-    hasselback = hasselback.fillna("").applymap(lambda c: set(c.split(";")))
-    fac_lookup = hasselback.to_dict()
+    fac_lookup = read_faculty(registry, FACULTY_FILE)
 
     # Compute distance to any faculty in co-author networks
     randomly_removed = set()
@@ -90,7 +90,7 @@ def main():
             continue
 
         # Read network
-        G = nx.read_gexf(f)
+        G = read_network(f, registry)
         print(f"... for {year} with {G.number_of_nodes():,} nodes ...")
         degrees = dict(G.degree())
         all_nodes.update(G.nodes())
@@ -103,7 +103,7 @@ def main():
         print("... in normal networks")
         dist = {adv: measure_faculty_distance(G, adv, fac_lookup, year) for
                 adv in tqdm(all_adv)}
-        df_n = melt_and_format(dist)
+        df_n = melt_and_format(dist, registry)
 
         # Social distance without deceased authors
         print("... in networks w/o deceased authors")
@@ -112,7 +112,7 @@ def main():
         G.remove_nodes_from(deceased)
         dist_d = {adv: measure_faculty_distance(G, adv, fac_lookup, year) for
                   adv in tqdm(all_adv)}
-        df_d = melt_and_format(dist_d).add_prefix("d_")
+        df_d = melt_and_format(dist_d, registry).add_prefix("d_")
 
         # Social distance with randomly removed authors
         print("... in networks w/o randomly removed authors")
@@ -128,7 +128,7 @@ def main():
         G.remove_nodes_from(randomly_removed)
         dist_r = {adv: measure_faculty_distance(G, adv, fac_lookup, year) for
                   adv in tqdm(all_adv)}
-        df_r = melt_and_format(dist_r).add_prefix("r_")
+        df_r = melt_and_format(dist_r, registry).add_prefix("r_")
 
         # Write out
         out = pd.concat([df_n, df_d, df_r], axis=1)
@@ -146,19 +146,19 @@ def main():
             continue
 
         # Read network
-        G = nx.read_gexf(f)
+        G = read_network(f, registry)
         print(f"... for {year} with {G.number_of_nodes():,} nodes ...")
         dist = {adv: measure_faculty_distance(G, adv, fac_lookup, year) for
                 adv in tqdm(all_adv)}
-        out = melt_and_format(dist)
+        out = melt_and_format(dist, registry)
         fname = TARGET_FOLDER/f"adviser_citation_{year}.csv"
         out.to_csv(fname, float_format='%.0f')
         print("... file saved")
 
     # Statistics
     all_members = set()
-    for c in hasselback.columns:
-        all_members.update({p for sl in hasselback[c].dropna().to_numpy() for p in sl})
+    for faculty in fac_lookup.values():
+        all_members.update(*faculty.values())
     stats = {"N_of_Hasselback_Fac_Network": len(all_members.intersection(all_nodes))}
     write_stats(stats)
 
@@ -4,26 +4,95 @@
 Tilburg Economics Ranking, by institution.
 
 For their methodology, please see https://econtop.uvt.nl/methodology.php.
+
+Publication counts by institution are kept per journal-year in
+401_institution_rankings/counts.csv.  With INCREMENTAL = True, only
+journal-years that are new or whose journal impact factors changed are
+aggregated again, and only scores and ranks of years whose rolling window
+contains such a journal-year are recomputed.
+
+Scopus results of a journal-year are kept in a ledger with their date of
+retrieval.  Results retrieved while the year was recent, i.e. less than
+RECENT_YEARS years old, are retrieved again once they are older than
+REFRESH_DAYS, and with INCREMENTAL = False all results are retrieved again.
+
+Scores are sums over rolling windows of several lengths, all derived from
+one cumulative sum of counts by institution and year.  weighted.csv and
+unweighted.csv contain the ranking for the main window, and windows.csv
+contains rankings for all windows and both weighting schemes.  The main
+ranking counts publications since START_YEAR-WINDOW only, so that its
+windows in the first years remain partial as in the published files;
+windows.csv uses all publications since START_YEAR-max(WINDOWS).
 """
 
+from datetime import date
 from itertools import product
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from pybliometrics.scopus import AffiliationRetrieval, ScopusSearch
-from pybliometrics.scopus.exception import Scopus404Error
+from pybliometrics.scopus import ScopusSearch
 from tqdm import tqdm
 
+from _117_get_faculty_lists import retrieve_affiliations
+from ledger import Ledger
+
 SOURCE_FILE = Path("./060_identifiers/Tilburg.csv")
 TARGET_FOLDER = Path("./401_institution_rankings/")
+LEDGER_FILE = TARGET_FOLDER/"ledger"
+COUNTS_FILE = TARGET_FOLDER/"counts.csv"
+JOURNALS_FILE = TARGET_FOLDER/"journals.csv"
 
-WINDOW = 5  # No. of years for rolling sum in ranking
+INCREMENTAL = True  # Update only journal-years that are new or changed
+RECENT_YEARS = 2  # No. of years after which Scopus coverage of a year is complete
+REFRESH_DAYS = 50  # Age of results of recent years after which they are renewed
+
+WINDOW = 5  # No. of years for rolling sum in main ranking
+WINDOWS = (3, 5, 7, 10)  # No. of years for rolling sums in all rankings
+SCHEMES = ("unweighted", "weighted")
 START_YEAR = 1999
 END_YEAR = 2020
 _doc_types = ("ar", "re", "cp", "sh", "no")
 _aff_types = ("univ", "coll")
 
 
+def compute_scores(pubs, agg, years, windows=WINDOWS):
+    """Compute sums of publications over each of `windows` years ending in
+    each of `years`, by institution, from one cumulative sum.
+    """
+    counts = pubs.pivot_table(index="institution", columns="year", values=agg,
+                              aggfunc="sum")
+    first = pubs["year"].min()
+    counts = counts.reindex(columns=range(first, pubs["year"].max()+1))
+    prefix = np.zeros((counts.shape[0], counts.shape[1]+1))
+    prefix[:, 1:] = counts.fillna(0).cumsum(axis=1).to_numpy()
+    end = np.array(years) - first + 1
+    scores = {}
+    for window in windows:
+        start = np.maximum(end - window, 0)
+        # Round away floating point differences of cumulative sums
+        values = (prefix[:, end] - prefix[:, start]).round(9)
+        scores[window] = pd.DataFrame(values, index=counts.index,
+                                      columns=pd.Index(years, name="year"))
+    return scores
+
+
+def count_publications(ledger, combs, sjr):
+    """Count (weighted) publications by institution in the given
+    journal-years.
+    """
+    data = [tuple(e) + (source_id,) for source_id, year in combs
+            for e in ledger_pubs(ledger.done[make_query(source_id, year)])]
+    cols = ["institution", "Sourceid", "year", "source"]
+    pubs = pd.DataFrame.from_records(data, columns=cols)
+    # Drop non-org affiliations
+    pubs = pubs[pubs["institution"].astype(str).str.startswith("6")]
+    return (pubs.merge(sjr, "left", on=["Sourceid", "year"])
+                .groupby(["institution", "year", "source"])
+                .agg(weighted=("SJR", "sum"), unweighted=("SJR", "size"))
+                .reset_index())
+
+
 def custom_long(df, value_name):
     """Melt wide DataFrame into a long list."""
     return (df.reset_index()
@@ -32,10 +101,70 @@ def custom_long(df, value_name):
               .sort_values(['institution', 'year']))
 
 
-def get_affiliation_info(aff_id, refresh=False):
-    """Get name and type of affiliation."""
-    aff = AffiliationRetrieval(aff_id, refresh=refresh)
-    return pd.Series((aff.affiliation_name, aff.org_type))
+def is_outdated(entry, year, today=None):
+    """Check whether the ledger entry of a journal-year was retrieved while
+    the year was recent and is older than REFRESH_DAYS.  Entries without
+    date of retrieval are outdated if the year is among the most recent.
+    """
+    today = today or date.today()
+    if not isinstance(entry, dict):
+        return year > END_YEAR - RECENT_YEARS
+    retrieved = date.fromisoformat(entry["retrieved"])
+    while_recent = retrieved < date(year + RECENT_YEARS + 1, 1, 1)
+    return while_recent and (today - retrieved).days > REFRESH_DAYS
+
+
+def ledger_pubs(entry):
+    """Return publications of a ledger entry, which is either a list of
+    publications or a dictionary with them and their date of retrieval.
+    """
+    if isinstance(entry, dict):
+        return entry["pubs"]
+    return entry
+
+
+def make_query(source_id, year):
+    """Return query for publications in a journal-year."""
+    return f'SOURCE-ID({source_id}) AND PUBYEAR IS {year}'
+
+
+def rank_scores(scores, meta, empty):
+    """Rank institutions of relevant types by year and return long list of
+    ranks and scores, omitting institution-years in `empty`.
+    """
+    types = meta["type"].str.split("|").str[0]
+    keep = types.reindex(scores.index).isin(_aff_types).to_numpy()
+    scores = scores[keep].mask(empty[keep])
+    ranks = scores.rank(method="min", ascending=False)
+    ranks = custom_long(ranks, "rank")
+    ranks["rank"] = ranks["rank"].astype(int)
+    return ranks.merge(custom_long(scores, "score"), on=['institution', 'year'])
+
+
+def read_counts():
+    """Read persistent publication counts by journal-year and the journal
+    impact factors used for them.
+    """
+    try:
+        counts = pd.read_csv(COUNTS_FILE, dtype={"institution": str})
+        journals = pd.read_csv(JOURNALS_FILE, index_col=["source", "year"])
+    except FileNotFoundError:
+        cols = ["institution", "year", "source", "weighted", "unweighted"]
+        counts = pd.DataFrame(columns=cols)
+        index = pd.MultiIndex.from_tuples([], names=["source", "year"])
+        journals = pd.DataFrame(columns=["SJR", "n_SJR"], index=index)
+    return counts, journals
+
+
+def read_ranking(scheme, window=WINDOW, folder=TARGET_FOLDER):
+    """Read ranking of weighting `scheme` ("weighted" or "unweighted")
+    based on publications over `window` years.
+    """
+    if window == WINDOW:
+        return pd.read_csv(folder/f"{scheme}.csv", encoding="utf8")
+    df = pd.read_csv(folder/"windows.csv", encoding="utf8")
+    df = df[(df["scheme"] == scheme) & (df["window"] == window)]
+    return df.drop(columns=["scheme", "window"]).reset_index(drop=True)
 
 
 def read_sjr():
@@ -49,7 +178,7 @@ def read_sjr():
     # Artificially extend journal impact factors
     min_year = sjr["year"].min()
     dummy = sjr[sjr["year"] == min_year].copy()
-    for year in range(START_YEAR-WINDOW, END_YEAR+1):
+    for year in range(START_YEAR-max(WINDOWS), END_YEAR+1):
         if year in sjr["year"].unique():
             continue
         dummy["year"] = year
@@ -57,76 +186,104 @@ def read_sjr():
     return sjr.reset_index(drop=True)
 
 
+def write_ranking(df, fname, years, fformat, keys=("institution", "year")):
+    """Write ranking sorted by `keys`, in incremental mode combined with
+    years not in `years` from the existing file.
+    """
+    if INCREMENTAL and fname.exists():
+        old = pd.read_csv(fname, dtype={"institution": str}, encoding="utf8")
+        df = pd.concat([old[~old["year"].isin(years)], df])
+    df = df.sort_values(list(keys))
+    df.to_csv(fname, index=False, encoding="utf8", float_format=fformat)
+
+
 def main():
     # Read list of sources
     sources = pd.read_csv(SOURCE_FILE, encoding="utf8")['scopus_id'].values
 
     # Parse publication lists
-    data = []
-    years = range(1999-WINDOW, END_YEAR+1)
+    years = range(START_YEAR-max(WINDOWS), END_YEAR+1)
     combs = list(product(sources, years))
     print(f">>> Parsing {len(sources):,} journals during {len(years):,} years")
+    ledger = Ledger(LEDGER_FILE)
+    retrieved = set()
     for source_id, year in tqdm(combs):
-        q = f'SOURCE-ID({source_id}) AND PUBYEAR IS {year}'
-        res = ScopusSearch(q, refresh=50).results or []
+        q = make_query(source_id, year)
+        if INCREMENTAL and q in ledger and not is_outdated(ledger.done[q], year):
+            continue
+        res = ScopusSearch(q, refresh=REFRESH_DAYS).results or []
+        new = []
         for p in res:
             if not p.afid or p.subtype not in _doc_types:
                 continue
             for a in p.afid.split(";"):
-                data.append((a, int(p.source_id), year))
+                new.append((a, int(p.source_id), year))
+        ledger.record(q, {"retrieved": date.today().isoformat(), "pubs": new})
+        retrieved.add((source_id, year))
+    ledger.close()
+    print("...", ledger.status())
 
-    # Drop non-org affiliations
-    pubs = pd.DataFrame.from_records(data, columns=["institution", "Sourceid", "year"])
-    pubs = pubs[pubs["institution"].str.startswith("6")]
-
-    # Count (weighted) publications
-    print(">>> Counting (weighted) publications...")
-    pubs = (pubs.merge(read_sjr(), "left", on=["Sourceid", "year"])
-                .groupby(["institution", "year"]).agg(weighted=("SJR", "sum"),
-                                                      unweighted=("SJR", "size"))
-                .reset_index())
+    # Count (weighted) publications of new or changed journal-years
+    sjr = read_sjr()
+    counts, journals = read_counts()
+    index = pd.MultiIndex.from_tuples(combs, names=["source", "year"])
+    current = (sjr.groupby(["Sourceid", "year"])["SJR"]
+                  .agg(SJR="sum", n_SJR="size")
+                  .reindex(index).fillna(0))
+    stale = (current != journals.reindex(index)).any(axis=1)
+    todo = [comb for comb, is_stale in zip(combs, stale)
+            if is_stale or comb in retrieved or not INCREMENTAL]
+    print(f">>> Counting (weighted) publications in {len(todo):,} journal-years...")
+    todo_index = pd.MultiIndex.from_tuples(todo, names=["source", "year"])
+    keep = ~counts.set_index(["source", "year"]).index.isin(todo_index)
+    counts = pd.concat([counts[keep], count_publications(ledger, todo, sjr)])
+    counts = (counts.astype({"year": int, "source": int, "weighted": float,
+                             "unweighted": int})
+                    .sort_values(["institution", "year", "source"]))
+    counts.to_csv(COUNTS_FILE, index=False)
+    current.to_csv(JOURNALS_FILE)
+    pubs = (counts.groupby(["institution", "year"])[["weighted", "unweighted"]]
+                  .sum().reset_index())
+
+    # Years whose rolling window contains updated journal-years
+    updated = {y + i for _, y in todo for i in range(max(WINDOWS))}
+    years = sorted(y for y in updated.intersection(pubs["year"].unique())
+                   if y >= START_YEAR-WINDOW)
+    if not years:
+        return
 
     # Collect institution information
     aff_ids = pubs["institution"].unique()
-    aff_data = {}
     print(f">>> Collecting information on {len(aff_ids):,} institutions...")
-    for aff_id in tqdm(aff_ids):
-        aff_data[aff_id] = get_affiliation_info(aff_id)
-    meta = pd.DataFrame(aff_data).T
-    meta.columns = ["name", "type"]
-
-    # Compute rolling sum and write out
-    print(">>> Computing ranks...")
-    for agg in ("unweighted", "weighted"):
-        # Compute rolling sum
-        scores = pubs.pivot_table(index="institution", columns="year",
-                                  values=agg, aggfunc=sum)
-        scores = (scores.rolling(WINDOW, axis=1, min_periods=0).sum()
-                        .join(meta, on="institution")
-                        .drop(columns="name"))
-
-        # Subset to specific institution types
-        scores["type"] = scores["type"].str.split("|").str[0]
-        scores = scores[scores["type"].isin(_aff_types)].drop(columns="type")
+    meta = retrieve_affiliations(aff_ids)[["name", "org_type"]]
+    meta = meta.rename(columns={"org_type": "type"})
+    meta.index = meta.index.astype(str)
 
+    # Compute rolling sums and ranks
+    print(f">>> Computing ranks for {len(years):,} years...")
+    scores = {agg: compute_scores(pubs, agg, years) for agg in SCHEMES}
+    rankings = []
+    for window in WINDOWS:
         # Drop institution-years w/o publications
-        if agg == "unweighted":
-            mask_zero = scores == 0
-        scores[mask_zero] = None
-
-        # Rank institutions by year
-        ranks = scores.rank(method="min", ascending=False)
-        ranks = custom_long(ranks, "rank")
-        ranks["rank"] = ranks["rank"].astype(int)
-        scores = custom_long(scores, "score")
-
-        # Write out
-        out = ranks.merge(scores, on=['institution', 'year'])
-        fname = (TARGET_FOLDER/agg).with_suffix(".csv")
-        fformat = '%.3f'
-        if agg == "unweighted":
-            fformat = '%.0f'
-        out.to_csv(fname, index=False, encoding="utf8", float_format=fformat)
+        empty = scores["unweighted"][window] == 0
+        for agg in SCHEMES:
+            out = rank_scores(scores[agg][window], meta, empty)
+            rankings.append(out.assign(scheme=agg, window=window))
+
+    # Main ranking on publications since START_YEAR-WINDOW, as published
+    base = pubs[pubs["year"] >= START_YEAR-WINDOW]
+    scores = {agg: compute_scores(base, agg, years, windows=(WINDOW,))[WINDOW]
+              for agg in SCHEMES}
+    empty = scores["unweighted"] == 0
+    for agg, fformat in zip(SCHEMES, ('%.0f', '%.3f')):
+        out = rank_scores(scores[agg], meta, empty)
+        write_ranking(out, TARGET_FOLDER/f"{agg}.csv", years, fformat)
+
+    # Write out
+    cols = ["scheme", "window", "institution", "year", "rank", "score"]
+    rankings = pd.concat(rankings)[cols]
+    write_ranking(rankings, TARGET_FOLDER/"windows.csv", years, '%.3f',
+                  keys=cols[:4])
 
 
 if __name__ == '__main__':
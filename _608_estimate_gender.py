@@ -4,21 +4,31 @@
 
 This script was written for free usage of genderize, which
 allows 1000 requests/day.  Run this script continuously on separate days
-to obtain all the information.
+to obtain all the information.  Names are requested in batches of up to
+10 and estimates are kept in a cache of normalised first names, which is
+shared across runs and cohorts.  Names still missing are kept in a queue
+file, which is worked off first-in first-out on the following days.
+
+Only an exhausted request limit ends a run quietly; other errors of the
+service are raised after the progress has been written.  A local stand-in
+for genderize.io is provided by fixture_servers.py.
 """
 
-from collections import OrderedDict
+from datetime import date
 from pathlib import Path
 
 import pandas as pd
 import genderize
-from numpy import where
 from tqdm import tqdm
 
 from _005_parse_students import write_stats
 
 STUDENT_FILE = Path("./005_student_lists/main.csv")
 TARGET_FILE = Path("./608_gender_estimates/genderize.csv")
+NAME_CACHE = Path("./608_gender_estimates/names.csv")
+QUEUE_FILE = Path("./608_gender_estimates/queue.txt")
+
+BATCH_SIZE = genderize.Genderize.BATCH_SIZE  # Names per request
 
 
 def clean_name(s):
@@ -45,41 +55,123 @@ def get_firstname(name):
         return None
 
 
-def main():
-    # Read names of students and actually used advisers
-    df = pd.read_csv(STUDENT_FILE, index_col=0, usecols=["stu_id", "Name"])
+def is_quota_error(exc):
+    """Check whether a GenderizeException signals the exhausted request
+    limit, by HTTP status or rate limit header.
+    """
+    status = next((a for a in exc.args if isinstance(a, int)), None)
+    headers = exc.args[-1] if len(exc.args) > 1 else {}
+    try:
+        remaining = headers.get("X-Rate-Limit-Remaining")
+    except AttributeError:
+        remaining = None
+    return status == 429 or remaining == "0"
+
+
+def normalize_name(name):
+    """Return case-insensitive key of a first name."""
+    return name.strip().casefold()
+
 
-    # Skip persons that already have estimates
+def query_names(names, cache, api_key=None, client=None):
+    """Query genderize.io in batches until names or daily quota are
+    exhausted, and add estimates to cache.
+    """
+    client = client or genderize.Genderize(api_key=api_key)
+    today = date.today().isoformat()
+    for i in tqdm(range(0, len(names), BATCH_SIZE)):
+        batch = names[i:i+BATCH_SIZE]
+        try:
+            resp = client.get(batch, retheader=True)
+        except genderize.GenderizeException as e:
+            if is_quota_error(e):
+                break
+            raise
+        for name, est in zip(batch, resp["data"]):
+            cache[normalize_name(name)] = {
+                "count": est.get("count"), "gender": est.get("gender"),
+                "name": est.get("name", name),
+                "probability": est.get("probability"), "retrieved": today}
+        remaining = resp["headers"].get("X-Rate-Limit-Remaining")
+        if remaining is not None and int(remaining) < BATCH_SIZE:
+            break
+    return cache
+
+
+def read_queue():
+    """Read queue of first names waiting for an estimate, oldest first."""
     try:
-        collected = pd.read_csv(TARGET_FILE, index_col=0)
-        collected = collected[collected.index.isin(df.index.tolist())]
-        df = df.drop(collected.index, errors='ignore')
+        text = QUEUE_FILE.read_text(encoding="utf8")
     except FileNotFoundError:
-        collected = pd.DataFrame()
+        return []
+    return [name for name in text.split("\n") if name]
+
+
+def read_name_cache():
+    """Read cache of gender estimates keyed on normalised first names,
+    alternatively seed it with previously collected estimates.
+    """
+    try:
+        cache = pd.read_csv(NAME_CACHE, index_col="key", keep_default_na=False,
+                            na_values=[""])
+    except FileNotFoundError:
+        try:
+            cache = pd.read_csv(TARGET_FILE, index_col=0, keep_default_na=False,
+                                na_values=[""])
+        except FileNotFoundError:
+            return {}
+        cache.index = cache["name"].apply(normalize_name)
+        cache = cache[~cache.index.duplicated()]
+    return cache.to_dict(orient="index")
+
+
+def update_queue(names, cache):
+    """Append new names to the queue and remove names with estimates."""
+    queue = {}
+    for name in read_queue() + list(names):
+        queue.setdefault(normalize_name(name), name)
+    return [name for key, name in queue.items() if key not in cache]
+
+
+def write_name_cache(cache):
+    """Write cache of gender estimates."""
+    out = pd.DataFrame.from_dict(cache, orient="index").sort_index()
+    out["count"] = out["count"].fillna(0).astype(int).replace(0, "")
+    out.to_csv(NAME_CACHE, index_label="key")
+
+
+def main():
+    # Read names of students and actually used advisers
+    df = pd.read_csv(STUDENT_FILE, index_col=0, usecols=["stu_id", "Name"])
 
     # Prepare names
     df["first"] = df["Name"].apply(get_firstname)
     df = df.dropna(subset=['first'])
+    df["key"] = df["first"].apply(normalize_name)
 
-    # Get gender estimates
-    estimates = OrderedDict()
-    n_names = df['first'].nunique()
-    print(f">>> Searching for {n_names:,} new names...")
-    for name in tqdm(df["first"].unique(), total=n_names):
-        try:
-            resp = genderize.Genderize().get([name])
-            estimates[name] = resp[0]
-        except genderize.GenderizeException:  # Daily quota exceeded
-            break
+    # Work off queue of names w/o estimates
+    cache = read_name_cache()
+    queue = update_queue(df["first"], cache)
+    print(f">>> Searching for {len(queue):,} queued names "
+          f"({len(cache):,} names cached)...")
+    try:
+        if queue:
+            cache = query_names(queue, cache)
+    finally:
+        if cache:
+            write_name_cache(cache)
+        queue = [name for name in queue if normalize_name(name) not in cache]
+        QUEUE_FILE.write_text("\n".join(queue), encoding="utf8")
+    if queue:
+        print(f"... {len(queue):,} names remain queued, run again tomorrow")
 
     # Write out
-    if estimates:
-        new = pd.DataFrame(estimates).T
-        df = df.join(new, how="right", on="first")
-        df = df[["count", "gender", "name", "probability"]]
-        collected = pd.concat([collected, df]).sort_index()
-        collected["count"] = collected["count"].fillna(0).astype(int).replace(0, "")
-        collected.to_csv(TARGET_FILE, index_label="id")
+    cols = ["count", "gender", "name", "probability"]
+    estimates = pd.DataFrame.from_dict(cache, orient="index")[cols]
+    collected = df[["key"]].join(estimates, how="inner", on="key")[cols]
+    collected = collected.sort_index()
+    collected["count"] = collected["count"].fillna(0).astype(int).replace(0, "")
+    collected.to_csv(TARGET_FILE, index_label="id")
 
     # Statistics
     counts = collected["gender"].value_counts()
@@ -7,7 +7,7 @@
 4. Rank and year of first affiliaton change
 """
 
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import pandas as pd
@@ -15,9 +15,10 @@ from pybliometrics.scopus import CitationOverview, ScopusSearch
 from tqdm import tqdm
 
 from _005_parse_students import write_stats
-from _117_get_faculty_lists import create_country_map
-from _215_compute_adviser_centralities import standardize, winsorize
-from _401_rank_institutions import END_YEAR
+from _117_get_faculty_lists import retrieve_affiliations
+from _401_rank_institutions import END_YEAR, WINDOW, read_ranking
+from ledger import Ledger
+from panel_ops import group_standardize, group_winsorize
 
 STUDENT_FILE = Path("./005_student_lists/main.csv")
 PLACEMENT_FILE = Path("./020_placements/placements.csv")
@@ -25,81 +26,89 @@ MAPPING_FOLDER = Path("./090_institution_data/")
 ADVISER_MAP = Path("./199_adviser-student_map/actual.csv")
 GENDER_FILE = Path("./608_gender_estimates/genderize.csv")
 TARGET_FILE = Path("./615_student_data/student.csv")
+LEDGER_FILE = Path("./615_student_data/careers")
 
 CITATION_RANGE = 5  # Count cites to publications this many years past placement
+MAX_WORKERS = 8  # No. of students processed in parallel
+MAX_LAG = 9  # Max. no. of years past placement to compare affiliations
 PLATFORMS = {"60020337", "60016621", "60007893"}
 
 _aff_map = pd.read_csv(MAPPING_FOLDER/"non_org.csv", dtype=str).set_index("nonorg")["org"].to_dict()
-tqdm.pandas()
 
 
-def compare_placement(aff_d, placement):
-    """Compare whether the placement is in the set of affiliations,
-    considering a certain lag.
+def compute_retention(panel, placements):
+    """Compute for each student and year past placement whether the
+    placement is among the affiliations, carrying forward the last
+    comparison through years without affiliations.
     """
-    same = {}
-    old_aff = True
-    for lag, affs in aff_d.items():
-        if lag > 9:
-            continue
-        key = f"plc_same-{lag:02d}"
-        if affs:
-            value = placement in affs
-            old_aff = placement in affs
-        else:
-            value = old_aff
-        same[key] = int(value)
-    return same
-
-
-def find_affiliation(p, auth_id):
-    """Find affiliation in an author's publication."""
-    try:
-        idx = p.author_ids.index(str(int(auth_id)))
-        affs = p.author_afids.split(";")[idx] or None
-        affs = set(affs.split("-"))
-        affs = set(_aff_map.get(a, a) for a in affs) - PLATFORMS
-        return affs
-    except (AttributeError, ValueError):  # No affiliation or author not in list
-        return set()
-
-
-def get_affiliation_type(aff_id, refresh=100):
-    """Get type of placement according to Scopus."""
-    from pybliometrics.scopus import AffiliationRetrieval
-    try:
-        aff_id = int(aff_id)
-        aff = AffiliationRetrieval(aff_id, refresh=refresh)
-        org_type = aff.org_type
-        country = country_map.get(aff.country)
-        if aff.country and not country:
-            print(aff.country)
-    except ValueError:
-        org_type = None
-        country = None
-    return pd.Series({"plc_type": org_type, "plc_country": country})
-
-
-def parse_affiliations(df, scopus_id, base_year):
-    """Parse affiliations listed on papers and sort them
-    relative to `base_year`.
+    panel = panel.join(placements.rename("plc"), on="stu_id")
+    panel["same"] = panel["aff"] == panel["plc"]
+    grouped = panel.groupby(["stu_id", "lag"])
+    same = grouped["same"].any().astype(float)
+    same = same.where(grouped["aff"].count() > 0)
+    return same.groupby(level="stu_id").ffill().fillna(1).astype(int)
+
+
+def make_career_panel(careers):
+    """Explode publications of all students into a long table of student,
+    years past placement and affiliation on publications past placement,
+    with missing affiliations for active years without any.
     """
-    # Get affiliations from papers
-    max_year = df["year"].max()
-    affs = defaultdict(lambda: set())
-    temp = df.dropna(subset=["author_afids"]).copy()
-    temp["lag"] = temp["year"] - base_year
-    temp = temp[temp["lag"] > 0]  # Consider only papers past PhD
-    if temp.empty:
-        return affs
-    temp["aff"] = temp.apply(lambda s: find_affiliation(s, scopus_id), axis=1)
+    # Publications past placement with affiliation information
+    pubs = careers["pubs"].explode().dropna()
+    cols = ["year", "author_ids", "author_afids"]
+    pubs = pd.DataFrame(pubs.tolist(), index=pubs.index, columns=cols)
+    pubs = pubs.rename_axis("stu_id").reset_index()
+    pubs["lag"] = pubs["year"] - pubs["stu_id"].map(careers["plc_year"])
+    max_lag = pubs.groupby("stu_id")["lag"].max()
+    pubs = pubs[(pubs["lag"] > 0) & pubs["author_afids"].notnull()].copy()
+    pubs["lag"] = pubs["lag"].astype(int)
+    # Affiliations at the (first) position of the student in the author list
+    scopus = pubs["stu_id"].map(careers["stu_scopus"]).astype("int64").astype(str)
+    authors = pubs["author_ids"].str.split(";").explode()
+    own = authors == scopus.reindex(authors.index)
+    position = authors.groupby(level=0).cumcount()[own].groupby(level=0).first()
+    afids = pubs["author_afids"].str.split(";").explode()
+    afids.index = pd.MultiIndex.from_arrays(
+        [afids.index, afids.groupby(level=0).cumcount()])
+    own = pd.MultiIndex.from_arrays([position.index, position])
+    afids = afids.reindex(own).droplevel(1)
+    affs = afids[afids != ""].str.split("-").explode()
+    affs = affs.map(_aff_map).fillna(affs)
+    affs = affs[~affs.isin(PLATFORMS)].rename("aff")
+    panel = pubs[["stu_id", "lag"]].join(affs)
     # Fill active years w/o publication
-    for y in range(1, max_year-base_year):
-        affs[y].update(set())
-    # Record all affiliations
-    for _, p in temp.iterrows():
-        affs[p.lag].update(p.aff)
-    return affs
+    grid = pd.MultiIndex.from_product(
+        [panel["stu_id"].unique(), range(1, MAX_LAG+1)],
+        names=["stu_id", "lag"]).to_frame(index=False)
+    grid = grid[grid["lag"] < grid["stu_id"].map(max_lag)]
+    panel = pd.concat([panel[panel["lag"] <= MAX_LAG], grid], ignore_index=True)
+    return panel.sort_values(["stu_id", "lag"], kind="stable")
+
+
+def process_student(stu_id, stu_scopus, stu_year, advisers):
+    """Retrieve co-authors, citations and publications with affiliations
+    of a student in a JSON-serializable record.
+    """
+    pubs = query_publications(stu_scopus)
+    out = {"stu_id": stu_id, "stu_scopus": stu_scopus}
+    # Store publications to parse affiliations later
+    cols = ["year", "author_ids", "author_afids"]
+    temp = pubs[cols].astype(object)
+    out["pubs"] = temp.where(temp.notnull(), None).values.tolist()
+    # Retrieve co-authors
+    pubs["author_ids"] = pubs["author_ids"].str.split(";")
+    mask_five = pubs["year"].between(stu_year, stu_year+5)
+    coauth = pubs[mask_five]["author_ids"]
+    out["coauthors"] = sorted(set([a for sl in coauth for a in sl]))
+    # Retrieve citations
+    mask_with_adv = pubs["author_ids"].apply(
+        lambda s: len(advisers.intersection(s)) > 0)
+    try:
+        out["cites"] = retrieve_citations(pubs[~mask_with_adv], stu_year)
+    except KeyError:
+        pass
+    return out
 
 
 def query_publications(scopus_id, refresh=100):
@@ -111,20 +120,19 @@ def query_publications(scopus_id, refresh=100):
     return temp[temp["year"] <= END_YEAR].sort_values("year")
 
 
-def read_rankings(verbose=True):
+def read_rankings(window=WINDOW, verbose=True):
     """Read our version of the unweighted and SJR weighted Tilburg
-    Economics Ranking.
+    Economics Ranking based on publications over `window` years.
     """
     # Read in
-    folder = Path("./401_institution_rankings/")
-    weighted = pd.read_csv(folder/"weighted.csv", encoding="utf",
-                           index_col=["institution", "year"])
+    weighted = read_ranking("weighted", window)
+    weighted = weighted.set_index(["institution", "year"])
     weighted = weighted.add_suffix("-w").reset_index()
     if verbose:
         sd = weighted.loc[weighted["year"] == 2004, "score-w"].std()
         print(f">>> 1 SD in the weighted score in 2004 equals {sd:.2f}")
     weighted = standardize_winsorize_df(weighted, col="score-w")
-    unweighted = pd.read_csv(folder/"unweighted.csv", encoding="utf")
+    unweighted = read_ranking("unweighted", window)
     unweighted = standardize_winsorize_df(unweighted)
     # Combine
     return weighted.join(unweighted, how="outer")
@@ -153,16 +161,12 @@ def retrieve_citations(df, year, refresh=False):
 
 def standardize_winsorize_df(df, col="score"):
     """Standardize and winsorize a column in a DataFrame year-wise."""
-    df[f"{col}-std"] = df.groupby("year")[col].apply(standardize)
-    grouped = df.groupby("year")
-    df[f"{col}-win"] = grouped[col].apply(winsorize)
-    df[f"{col}-std-win"] = grouped[f"{col}-std"].apply(winsorize)
+    df[f"{col}-std"] = group_standardize(df[col], df["year"])
+    df[f"{col}-win"] = group_winsorize(df[col], df["year"])
+    df[f"{col}-std-win"] = group_winsorize(df[f"{col}-std"], df["year"])
     return df.set_index(["institution", "year"])
 
 
-country_map = create_country_map()
-
-
 def main():
     # Read in
     cols = ['stu_id', 'stu_school', 'stu_jel', 'stu_year', 'stu_scopus']
@@ -217,8 +221,11 @@ def main():
 
     # Merge affiliation types
     print(f">>> Retrieving affiliation information...")
-    info = df['plc_scopus'].progress_apply(get_affiliation_type)
-    df = pd.concat([df, info], axis=1)
+    info = retrieve_affiliations(df["plc_scopus"], refresh=100)
+    info = info[["org_type", "country"]]
+    info.index = info.index.astype("float64")
+    info = info.rename(columns={"org_type": "plc_type", "country": "plc_country"})
+    df = df.join(info, on="plc_scopus")
     print("... Distribution of types and countries:")
     print(df['plc_type'].value_counts())
     print(df['plc_country'].value_counts())
@@ -242,10 +249,6 @@ def main():
 
     # Retrieve career and citation information
     print(">>> Counting citations and searching affiliations...")
-    affs = {}
-    cites = {}
-    change = {}
-    coauthors = {}
     students = students.dropna(subset=["stu_scopus"])
     advisers = pd.read_csv(ADVISER_MAP, index_col="stu_id",
                            usecols=["stu_id", "adv_scopus"])
@@ -253,42 +256,56 @@ def main():
     students = students.join(advisers)
     students = students.dropna(subset=["adv_scopus"])
     adv_map = students["adv_scopus"].to_dict()
-    for idx, row in tqdm(df.iterrows(), total=df.shape[0]):
-        # Query publications
-        try:
-            student_id = int(row["stu_scopus"])
-        except ValueError:
-            continue
-        pubs = query_publications(student_id)
-        # Retrieve co-authors
-        stu_adv = set(adv_map.get(idx, set()))
-        pubs["author_ids"] = pubs["author_ids"].str.split(";")
-        mask_five = pubs["year"].between(row.stu_year, row.stu_year+5)
-        coauth = pubs[mask_five]["author_ids"]
-        coauthors[student_id] = set([a for sl in coauth for a in sl])
-        # Retrieve citations
-        mask_with_adv = pubs["author_ids"].apply(
-            lambda s: len(stu_adv.intersection(s)) > 0)
-        try:
-            cites[student_id] = retrieve_citations(pubs[~mask_with_adv], row["stu_year"])
-        except KeyError:
-            pass
-        # Retrieve affiliations
-        if row["plc_scopus"] != row["plc_scopus"]:
-            continue
-        aff_d = parse_affiliations(pubs, str(student_id), int(row["plc_year"]))
-        retention = compare_placement(aff_d, str(int(row["plc_scopus"])))
-        affs[student_id] = retention
-        # Get first affiliation after change
-        try:
-            idx = min([k for k, v in retention.items() if v == 0])
-            lag = int(idx.split("-")[-1])
-            change[student_id] = (aff_d[lag], row["plc_year"]+lag)
-        except ValueError:
-            change[student_id] = (None, None)
-    change = pd.Series(change).apply(pd.Series).dropna()
-    change.columns = ["aff_id", "change_year"]
-    change = change.explode('aff_id')
+    tasks = df.dropna(subset=["stu_scopus"])
+    ledger = Ledger(LEDGER_FILE)
+    done = [unit for unit, record in ledger.done.items() if "pubs" in record]
+    tasks = tasks[~tasks.index.isin(done)]
+    print(f"... {len(ledger):,} students done, {tasks.shape[0]:,} to go")
+    failed = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        for idx, row in tasks.iterrows():
+            f = executor.submit(process_student, idx, int(row["stu_scopus"]),
+                                int(row["stu_year"]),
+                                set(adv_map.get(idx, set())))
+            futures[f] = idx
+        for f in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                record = f.result()
+            except Exception as e:
+                print(f"... {futures[f]}: {type(e).__name__} {e}")
+                failed += 1
+                continue
+            ledger.record(record["stu_id"], record)
+    ledger.close()
+    print("...", ledger.status())
+    if failed:
+        print(f"... {failed:,} students failed, re-run to resume")
+
+    # Compute retention and change from career records
+    cols = ["stu_id", "stu_scopus", "coauthors", "cites", "pubs"]
+    careers = pd.DataFrame(ledger.done.values(), columns=cols).set_index("stu_id")
+    careers = careers[careers.index.isin(df.index)]
+    coauthors = careers.set_index("stu_scopus")["coauthors"].apply(set).to_dict()
+    cites = careers.dropna(subset=["cites"]).set_index("stu_scopus")["cites"]
+    cites = cites.to_dict()
+    careers = (careers.join(df[["plc_scopus", "plc_year"]])
+                      .dropna(subset=["plc_scopus"]))
+    panel = make_career_panel(careers)
+    placements = careers["plc_scopus"].astype("uint64").astype(str)
+    retention = compute_retention(panel, placements)
+    affs = retention.unstack()
+    affs.columns = [f"plc_same-{lag:02d}" for lag in affs.columns]
+    affs.index = affs.index.map(careers["stu_scopus"])
+    affs = affs[~affs.index.duplicated(keep="last")]
+    # Get first affiliations after change
+    first = retention[retention == 0].reset_index().groupby("stu_id")["lag"].min()
+    change = (panel.merge(first.reset_index(), on=["stu_id", "lag"])
+                   .dropna(subset=["aff"]).drop_duplicates())
+    change["change_year"] = change["lag"] + change["stu_id"].map(careers["plc_year"])
+    change["stu_scopus"] = change["stu_id"].map(careers["stu_scopus"])
+    change = (change.rename(columns={"aff": "aff_id"})
+                    .set_index("stu_scopus")[["aff_id", "change_year"]])
     change["aff_id"] = change["aff_id"].astype("uint64")
 
     # Compute affiliation rank of changes
@@ -304,7 +321,7 @@ def main():
 
     # Merge all
     cite_label = f"stu_citestock_{CITATION_RANGE}p"
-    df = (df.join(pd.DataFrame(affs).T, on='stu_scopus')
+    df = (df.join(affs, on='stu_scopus')
             .drop("school_scopus", axis=1)
             .join(pd.Series(cites, name=cite_label), on="stu_scopus")
             .join(change, on="stu_scopus"))
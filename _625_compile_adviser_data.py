@@ -5,7 +5,9 @@
 from pathlib import Path
 
 import pandas as pd
-from pybliometrics.scopus import AuthorRetrieval
+
+from _005_parse_students import read_registry, student_keys
+from _117_get_faculty_lists import retrieve_authors
 
 REFERENCE_YEAR = 2003  # Year in which values for comparison table are computed
 
@@ -15,12 +17,6 @@ TARGET_FILE = Path("./625_adviser_data/adviser.csv")
 OUTPUT_FOLDER = Path("./990_output/")
 
 
-def get_adviser_name(auth_id, refresh=100):
-    """Get Scopus author information for advisers."""
-    au = AuthorRetrieval(auth_id, refresh=refresh)
-    return " ".join([au.given_name, au.surname])
-
-
 def make_top_table(df, fname, cutoff):
     """Produce table showing the top `cutoff` advisers."""
     # Fix table dimension
@@ -28,7 +24,8 @@ def make_top_table(df, fname, cutoff):
     top_adv["Rank"] = top_adv["Rank"].astype("uint8")
     top_adv = top_adv.reset_index()
     # Compute values
-    top_adv["Name"] = top_adv['adv_scopus'].apply(get_adviser_name)
+    names = retrieve_authors(top_adv['adv_scopus'])["name"]
+    top_adv["Name"] = top_adv['adv_scopus'].map(names)
     top_adv["Euclid"] = top_adv["Euclid"].round(2)
     top_adv["Experience"] = top_adv["Experience"].astype("uint8")
     columns = ["Rank", "Name", "Students", "School", "Citations",
@@ -47,7 +44,9 @@ def make_top_table(df, fname, cutoff):
 def main():
     # Map adviser to school
     stu = pd.read_csv(ADVISER_FILE, usecols=["stu_id", "adv_scopus"]).dropna()
-    stu["stu_school"] = stu["stu_id"].str.split(";").str[1]
+    registry = read_registry()
+    stu["stu_key"] = student_keys(stu["stu_id"], registry)
+    stu = stu.join(registry["stu_school"].astype(str), on="stu_key")
     stu = stu.set_index("stu_school")
     schools = (stu["adv_scopus"].str.split(";", expand=True)
                   .stack().to_frame("adv_scopus")
@@ -6,26 +6,66 @@ from pathlib import Path
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 from tqdm import tqdm
 
-from _005_parse_students import write_stats
+from _005_parse_students import read_registry, student_ids, student_keys,\
+    write_stats
+from _199_map_advisers_to_students import read_draws
+from panel_ops import shift_panel
 
 STUDENT_FILE = Path("./615_student_data/student.csv")
 ADVISER_FILE = Path("./625_adviser_data/adviser.csv")
 ADVSTU_FOLDER = Path("./199_adviser-student_map/")
 TARGET_FOLDER = Path("./680_centrality_masters/")
+RANDOM_FOLDER = TARGET_FOLDER/"random"
 OUTPUT_FOLDER = Path("./990_output/")
 
 # Main placement rank/occurrence specification
 COAUTH_SPEC = "plc_score-w"
 
+CHUNK_SIZE = 50  # No. of random draws stacked at once
+EXPORT_CSV = False  # Additionally write one CSV file per draw
+RANDOM_COLS = ["plc_score-w-std", "adv_ev-w-win99-std",
+               "first_ev-w-win99-std_mean", "adv_euclid", "adv_experience",
+               "adviser", "stu_sex", "school_rank-w", "stu_year", "stu_jel",
+               "stu_school", "adv_occ"]
+RANDOM_STU_COLS = ["stu_key", "plc_score-w", "plc_score-w-std", "stu_sex",
+                   "school_rank-w", "stu_year", "stu_jel", "stu_school"]
+
 mpl.use('Agg')
 sns.set(style="whitegrid", font='Utopia')
 plt.rc('axes', titlesize=20)
 
 
+def anonymize(values, categories):
+    """Replace values by labels of their position in `categories`, using
+    letters in bijective base 26 (a, ..., z, aa, ab, ...).  Values not in
+    `categories` become missing.
+    """
+    codes = pd.Categorical(values, categories=categories).codes.astype("int64")
+    # Number of letters: codes from 26+...+26**(k-1) on need k letters
+    lengths = np.ones(codes.shape[0], dtype="int64")
+    bound = 26
+    while (codes >= bound).any():
+        lengths += codes >= bound
+        bound = 26*(bound+1)
+    width = int(lengths.max(initial=1))
+    chars = np.zeros((codes.shape[0], width), dtype="uint8")
+    rest = codes.copy()
+    rows = np.arange(codes.shape[0])
+    for digit in range(width):
+        active = (lengths > digit) & (codes >= 0)
+        pos = lengths - 1 - digit
+        chars[rows[active], pos[active]] = 97 + rest[active] % 26
+        rest = rest//26 - 1
+    labels = chars.view(f"S{width}").ravel().astype(str).astype(object)
+    labels[codes < 0] = None
+    return labels
+
+
 def count_adv_occurrences(df, score_var="plc_score-w", year_var='stu_year',
                           col='best_adviser', centr_var='first_ev-w-win99-std_mean'):
     """Count number of years in which adviser has placed students
@@ -42,6 +82,16 @@ def count_adv_occurrences(df, score_var="plc_score-w", year_var='stu_year',
     return counts.to_frame(name="adv_occ")
 
 
+def count_draw_occurrences(panel, score_var="plc_score-w", year_var='stu_year',
+                           col='adviser', centr_var='first_ev-w-win99-std_mean'):
+    """Count number of years in which adviser has placed students
+    academically, separately for each draw.
+    """
+    mask = panel[centr_var].notnull() & panel[score_var].notnull()
+    subset = panel.loc[mask, ["draw", col, year_var]].drop_duplicates()
+    return subset.groupby(["draw", col]).size().to_frame("adv_occ")
+
+
 def get_quartiles(temp, unit, var, verbose=False):
     """Safely compute non-overlapping sets compromising quartiles."""
     quartiles = temp[var].quantile([0.25, 0.5, 0.75]).values
@@ -62,6 +112,17 @@ def get_quartiles(temp, unit, var, verbose=False):
     return cats
 
 
+def make_adviser_year(adv_data, centr):
+    """Combine adviser data and centralities needed for random masters."""
+    centr_cols = ["adv_ev-w-win99-std", "first_ev-w-win99-std_mean"]
+    centr = centr[centr_cols].reset_index().astype({"node": "int64"})
+    return (adv_data[["adv_euclid", "adv_experience"]].reset_index()
+            .merge(centr, how="left", left_on=["adv_scopus", "year"],
+                   right_on=["node", "year"])
+            .drop(columns="node")
+            .set_index(["adv_scopus", "year"]))
+
+
 def make_histogramm(df, fname, var="plc_score-w-std", figsize=(10, 5),
                     label="Standarized placement score"):
     """Make histogramm with KDE overlay."""
@@ -82,6 +143,23 @@ def make_histogramm(df, fname, var="plc_score-w-std", figsize=(10, 5),
     plt.close(fig)
 
 
+def make_lookup(index, advisers, years):
+    """Map pairs of adviser and year positions to rows of an adviser-year
+    index, with -1 for missing pairs.
+    """
+    adv_pos = pd.Index(advisers).get_indexer(index.get_level_values(0))
+    year_pos = years.get_indexer(index.get_level_values(1))
+    mask = (adv_pos >= 0) & (year_pos >= 0)
+    lookup = np.full((len(advisers), len(years)), -1, dtype="int64")
+    lookup[adv_pos[mask], year_pos[mask]] = np.flatnonzero(mask)
+    return lookup
+
+
+def prefix_ids(ids, prefix="a"):
+    """Turn integer IDs into strings with a prefix."""
+    return np.char.add(prefix, np.asarray(ids).astype(str)).astype(object)
+
+
 def read_agg_centr(network):
     """Read aggregated centralities."""
     out = []
@@ -112,6 +190,34 @@ def read_distance_files():
     return dist
 
 
+def read_random_inputs():
+    """Read student data and adviser-year data for random masters."""
+    df = read_students(RANDOM_STU_COLS[1:])
+    adv_data = pd.read_csv(ADVISER_FILE, index_col=["adv_scopus", "year"])
+    adv_year = make_adviser_year(adv_data, read_agg_centr("coauthor"))
+    return df[RANDOM_STU_COLS], adv_year
+
+
+def read_random_masters(scheme, draws=None, folder=RANDOM_FOLDER):
+    """Read stacked master files of random assignments of `scheme`,
+    optionally only for selected draws.
+    """
+    filters = None
+    if draws is not None:
+        filters = [("draw", "in", list(draws))]
+    return pd.read_parquet(folder/f"scheme={scheme}", filters=filters)
+
+
+def read_students(cols=None):
+    """Read student data with integer student keys instead of IDs, sorted
+    by key.
+    """
+    usecols = None if cols is None else ["stu_id"] + cols
+    df = pd.read_csv(STUDENT_FILE, usecols=usecols)
+    df.insert(0, "stu_key", student_keys(df.pop("stu_id"), read_registry()))
+    return df.sort_values("stu_key").reset_index(drop=True)
+
+
 def share_by_category(df, col='school_rank-w'):
     """Create DataFrame with numbers and shares of students by school group."""
     # Create rank category mapping
@@ -125,12 +231,68 @@ def share_by_category(df, col='school_rank-w'):
     return counts
 
 
+def stack_draws(df, adv_year, lookup, years, draws, students, advisers,
+                first_draw=0):
+    """Stack random assignments of several draws into one panel of students
+    and the data of their random advisers.  `students` holds the keys of
+    the students in the columns of `draws`.
+    """
+    # Position of each student in the draws, through an array over all keys
+    keys = df["stu_key"].to_numpy()
+    positions = np.full(max(keys.max(), students.max(), 0) + 1, -1)
+    known = np.flatnonzero(students >= 0)
+    positions[students[known]] = known
+    cols = np.where(keys >= 0, positions[np.maximum(keys, 0)], -1)
+    year_pos = years.get_indexer(df["stu_year"])
+    adv = np.asarray(draws)[:, cols]
+    adv[:, cols < 0] = -1
+    rows = np.where(adv >= 0, lookup[adv, year_pos], -1)
+    draw_idx, stu_idx = np.nonzero(rows >= 0)
+    panel = pd.concat([df.iloc[stu_idx].reset_index(drop=True),
+                       adv_year.iloc[rows[draw_idx, stu_idx]].reset_index(drop=True)],
+                      axis=1)
+    panel.insert(0, "draw", draw_idx + first_draw)
+    panel.insert(1, "adviser", advisers[adv[draw_idx, stu_idx]])
+    # Merge adviser occurrences
+    panel = panel.join(count_draw_occurrences(panel), on=["draw", "adviser"])
+    panel.loc[panel['adv_ev-w-win99-std'].isna(), "adv_occ"] = 0
+    panel["adv_occ"] = panel["adv_occ"].fillna(0)
+    panel["adviser"] = prefix_ids(panel["adviser"])
+    return panel
+
+
+def write_random_masters(scheme, df, adv_year, chunk_size=CHUNK_SIZE):
+    """Write master files of random assignments of `scheme` in chunks of
+    draws to one partitioned Parquet dataset.
+    """
+    draws, students, advisers = read_draws(scheme, folder=ADVSTU_FOLDER)
+    students = student_keys(students, read_registry())
+    years = pd.Index(sorted(df["stu_year"].unique()))
+    lookup = make_lookup(adv_year.index, advisers, years)
+    folder = RANDOM_FOLDER/f"scheme={scheme}"
+    folder.mkdir(parents=True, exist_ok=True)
+    for file in folder.glob("*.parquet"):
+        file.unlink()
+    for start in tqdm(range(0, draws.shape[0], chunk_size)):
+        chunk = draws[start:start+chunk_size]
+        panel = stack_draws(df, adv_year, lookup, years, chunk, students,
+                            advisers, first_draw=start)
+        panel = panel[["draw", "stu_key"] + RANDOM_COLS]
+        panel.to_parquet(folder/f"part{start:04d}.parquet", index=False)
+        if not EXPORT_CSV:
+            continue
+        for draw, group in panel.groupby("draw"):
+            fname = TARGET_FOLDER/f"random_{scheme}{draw:03d}.csv"
+            group[RANDOM_COLS].to_csv(fname, index=False)
+
+
 def main():
     # Read student data
-    df = pd.read_csv(STUDENT_FILE).drop(columns=["change_scopus"])
+    registry = read_registry()
+    df = read_students().drop(columns=["change_scopus"])
     print(f">>> Starting with {df.shape[0]:,} students")
     share_initial = share_by_category(df)
-    df = df.drop(columns=["stu_scopus", "stu_rank"]).sort_values("stu_id")
+    df = df.drop(columns=["stu_scopus", "stu_rank"])
 
     # Read auxiliary data
     adv_data = pd.read_csv(ADVISER_FILE, index_col=["adv_scopus", "year"])
@@ -139,42 +301,27 @@ def main():
     # Merge most prolific adviser and their data
     adv_actual = pd.read_csv(ADVSTU_FOLDER/"actual.csv", index_col="stu_id",
                              usecols=["stu_id", "adv_scopus"])
-    df_a = df.join(adv_actual, on="stu_id")
-    adv = (df_a.set_index(["stu_id", "stu_year"])['adv_scopus'].str.split(";", expand=True)
+    adv_actual.index = student_keys(adv_actual.index, registry)
+    df_a = df.join(adv_actual[adv_actual.index >= 0], on="stu_key")
+    adv = (df_a.set_index(["stu_key", "stu_year"])['adv_scopus'].str.split(";", expand=True)
                .stack().to_frame("adviser")
                .droplevel(2).reset_index())
     adv["adviser"] = adv["adviser"].astype("uint64")
     best = adv.join(adv_data, on=['adviser', 'stu_year'])
     best = (best.sort_values('adv_euclid', ascending=False)
-                .groupby('stu_id').head(1)  # Pick row with highest Euclid
+                .groupby('stu_key').head(1)  # Pick row with highest Euclid
                 .rename(columns={'adviser': 'best_adviser'})
                 .set_index('best_adviser'))
-    df_a = (df_a.merge(best.reset_index(), how="inner", on=['stu_id', 'stu_year'])
+    df_a = (df_a.merge(best.reset_index(), how="inner", on=['stu_key', 'stu_year'])
                 .drop(columns='adv_scopus'))
     df_a["best_adviser"] = df_a["best_adviser"].astype("uint64")
     print(f">>> {df_a.shape[0]:,} students left with adviser information")
 
     # Merge student data with random advisers
     print(">>> Creating files with random assignments")
-    centr_cols = ["adv_ev-w-win99-std", "first_ev-w-win99-std_mean"]
-    cols = ["plc_score-w-std", "adv_ev-w-win99-std", "first_ev-w-win99-std_mean",
-            "adv_euclid", "adv_experience", "adviser", "stu_sex", "school_rank-w",
-            "stu_year", "stu_jel", "stu_school", "adv_occ"]
-    for r_file in tqdm(list(ADVSTU_FOLDER.glob("random*.csv"))):
-        adv_random = pd.read_csv(r_file, index_col="stu_id")
-        df_r = (df.join(adv_random, how="left", on="stu_id")
-                  .rename(columns={"random": "adviser"})
-                  .drop(columns='stu_plc'))
-        df_r = df_r.join(adv_data, how="inner", on=['adviser', 'stu_year'])
-        df_r["adviser"] = df_r["adviser"].astype("uint64")
-        coauth_r = df_r.join(centr[centr_cols], on=['adviser', 'stu_year'])
-        coauth_r = coauth_r.drop(columns=coauth_r.filter(like="plc_same", axis=1).columns)
-        counts_r = count_adv_occurrences(coauth_r, col='adviser')
-        coauth_r = coauth_r.join(counts_r, on="adviser")
-        coauth_r.loc[coauth_r['adv_ev-w-win99-std'].isna(), "adv_occ"] = 0
-        coauth_r["adv_occ"] = coauth_r["adv_occ"].fillna(0)
-        coauth_r["adviser"] = "a" + coauth_r["adviser"].astype(str)
-        coauth_r[cols].to_csv(TARGET_FOLDER/r_file.parts[-1], index=False)
+    adv_year = make_adviser_year(adv_data, centr)
+    for scheme in ("distribution", "field"):
+        write_random_masters(scheme, df[RANDOM_STU_COLS], adv_year)
 
     # Add social distance
     dist = read_distance_files()
@@ -187,13 +334,13 @@ def main():
     temp_drops = ['adv_deg', 'first_deg_mean', 'second_deg_mean', 'adv_ev-w_d',
                   'adv_ev-w-win99_d', 'adv_ev-w-std_d', 'adv_ev-w-win99-std_d',
                   'first_dec', 'second_dec', 'third_dec']
+    cols = [c for c in centr.columns if c not in ["node", "year"]]
     for t in range(1, 3):
-        lead = dummy.copy()
-        lead["year"] -= t
-        lead = lead.set_index(["node", "year"])
         suffix = f"_l{t}"
-        centr = (centr.drop(columns=temp_drops)
-                      .join(lead, on=["node", "year"], rsuffix=suffix))
+        # Columns in temp_drops are replaced by their leads without suffix
+        lead = shift_panel(dummy, cols, t).rename(
+            columns=lambda c: c if c in temp_drops else c + suffix)
+        centr = centr.drop(columns=temp_drops).join(lead)
         corr = centr[["adv_ev-w", "adv_ev-w" + suffix]].corr().iloc[0, 1]
         print(f"... with {t}-year lead: {corr:.3}")
     coauth = (df_a.merge(centr, left_on=['best_adviser', 'stu_year'],
@@ -217,7 +364,9 @@ def main():
     coauth = coauth.join(adv_exp_cats, on="best_adviser")
 
     # Write out actual advisers
-    coauth["best_adviser"] = "a" + coauth["best_adviser"].astype(str)
+    coauth["best_adviser"] = prefix_ids(coauth["best_adviser"])
+    coauth.insert(0, "stu_id", student_ids(coauth.pop("stu_key"), registry))
+    coauth = coauth.sort_values("stu_id")
     assert coauth.shape[0] == coauth["stu_id"].nunique()
     coauth.to_csv(TARGET_FOLDER/"master.csv", index=False)
 
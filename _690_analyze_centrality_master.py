@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
+"""Estimates OLS and 2SLS specifications on the centrality master and
+writes the regression tables.
+
+Fixed effects are absorbed by alternating projections.  Demeaned variables
+are cached per estimation sample and set of fixed effects, such that
+specifications sharing a sample only demean variables not seen before.
+Standard errors are clustered two-way by adviser and PhD school.
+
+Logit estimations and summary statistics remain in
+_690_analyze_centrality_master.do.
+"""
+
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, t
+
+SOURCE_FILE = Path("./680_centrality_masters/master.csv")
+OUTPUT_FOLDER = Path("./990_output/")
+
+CENTR = "adv_ev-w-win99-std"
+FIRST = "first_ev-w-win99-std_mean"
+SECOND = "second_ev-w-win99-std_mean"
+CONTROLS = ["adv_euclid", "stu_female", "school_rank-w"]
+FIXED_EFFECTS = ["best_adviser", "adv_experience", "stu_jel", "stu_year"]
+CLUSTERS = ["best_adviser", "stu_school"]
+
+INDICATORS = {"best_adviser": "Adviser FE",
+              "adv_experience": "Adviser experience FE",
+              "stu_jel": "Field FE", "stu_year": "Graduation year FE"}
+LABELS = {
+    "adv_euclid": "Adviser Euclid", "adv_experience": "Adviser experience",
+    "adv_experience2": "Adv. experience$^2$",
+    "adv_experience_x_adv_euclid": "Adviser experience $\\times$ Adviser Euclid",
+    "adv_ev-w": "Adviser eigenvector score",
+    "adv_deg": "Adviser degree", "first_deg_mean": "Adviser neigh. mean degree",
+    "plc_score-w-std": "Placement score", "plc_score-w": "Placement score",
+    "plc_rank-w": "Placement rank",
+    CENTR: "Adviser centrality", FIRST: "Adviser's coauthors centrality",
+    SECOND: "Adviser's second neighbour centrality",
+    "stu_female": "Student female", "school_rank-w": "PhD school rank",
+    "school_rank-w2": "PhD school rank$^2$",
+    "school_rank-w3": "PhD school rank$^3$",
+    "school_rank-w_x_centr": "PhD school rank $\\times$ Adviser centrality",
+    "school_score-w": "PhD school score",
+    "citestock_growth9699": "Citation growth rate 96-99",
+    "citeflow_growth1": "Citation growth last year",
+    "citestock_growth3": "Citation growth past 3 years",
+    "stu_citestock_5p": "5-year student citations",
+    CENTR + "_l1": "Adviser centrality in t+1",
+    FIRST + "_l1": "Adviser's coauthors centrality in t+1",
+    SECOND + "_l1": "Adviser's 2nd neigh. centrality in t+1",
+    CENTR + "_l2": "Adviser centrality in t+2",
+    FIRST + "_l2": "Adviser's coauthors centrality in t+2",
+    SECOND + "_l2": "Adviser's 2nd neigh. centrality in t+2",
+    "adv_dist": "Social distance adviser to placement",
+    "centralitydeathshock_adv": "Change in centrality due to death",
+    "diffrank": "Rank difference", "diffrankdummy": "Second plc worse than first",
+    "first_dec": "Coauthor died", "second_dec": "Second neighbour died",
+    "third_dec": "Third neighbour died"}
+
+
+class Demeaner:
+    """Absorb fixed effects of one sample and cache demeaned variables."""
+    def __init__(self, df, fes):
+        self.df = df
+        codes = [encode(df[c].to_numpy()) for c in fes]
+        self.fes = codes or [np.zeros(df.shape[0], dtype="int64")]
+        self.n_absorbed = sum(c.max()+1 for c in self.fes) - len(self.fes) + 1
+        self._cache = {}
+
+    def __call__(self, cols):
+        missing = [c for c in cols if c not in self._cache]
+        if missing:
+            X = self.df[missing].to_numpy(dtype="float64")
+            self._cache.update(zip(missing, absorb(X, self.fes).T))
+        return np.column_stack([self._cache[c] for c in cols])
+
+
+def absorb(X, fes, tol=1e-10, max_iter=10_000):
+    """Partial out fixed effects from the columns of X by alternating
+    projections.
+    """
+    X = X.copy()
+    counts = [np.bincount(codes) for codes in fes]
+    for _ in range(max_iter):
+        delta = 0
+        for codes, count in zip(fes, counts):
+            means = np.column_stack([np.bincount(codes, weights=col)
+                                     for col in X.T]) / count[:, None]
+            X -= means[codes]
+            delta = max(delta, np.abs(means).max())
+        if delta < tol:
+            break
+    return X
+
+
+def cluster_vcov(Xhat, u, bread, clusters, dof=None):
+    """Compute multi-way cluster-robust variance-covariance matrix.
+
+    With `dof` = (N, K), each component receives the small-sample
+    correction G/(G-1) * (N-1)/(N-K).
+    """
+    k = Xhat.shape[1]
+    vcov = np.zeros((k, k))
+    if not k:
+        return vcov
+    for n_dims in range(1, len(clusters)+1):
+        sign = (-1)**(n_dims+1)
+        for combo in combinations(clusters, n_dims):
+            codes = combo[0]
+            for other in combo[1:]:
+                codes = encode(codes*(other.max()+1) + other)
+            scores = np.column_stack([np.bincount(codes, weights=col)
+                                      for col in (Xhat*u[:, None]).T])
+            factor = sign
+            if dof:
+                n_groups = scores.shape[0]
+                factor *= n_groups/(n_groups-1) * (dof[0]-1)/(dof[0]-dof[1])
+            vcov += factor * bread @ (scores.T @ scores) @ bread
+    return vcov
+
+
+def encode(values):
+    """Encode values as consecutive integers."""
+    return pd.factorize(values)[0]
+
+
+def estimate(df, y, exog, endog=None, instrument=None, fes=FIXED_EFFECTS,
+             clusters=CLUSTERS, sample=None, small=False, cache=None):
+    """Estimate OLS of y on exogenous variables, or 2SLS if `endog` and
+    `instrument` are given, absorbing fixed effects `fes`.
+
+    Observations with missing values in any variable are dropped.  With
+    `small`, standard errors receive small-sample corrections and p values
+    are based on the t distribution (as in vcemway), otherwise on the
+    normal distribution (as in ivreg2).  Demeaned variables are cached in
+    `cache` by sample and fixed effects.
+    """
+    if cache is None:
+        cache = {}
+    regressors = ([endog] if endog else []) + exog
+    instruments = ([instrument] if instrument else []) + exog
+    cols = list(dict.fromkeys([y] + regressors + instruments + fes + clusters))
+    mask = df[cols].notnull().all(axis=1)
+    if sample is not None:
+        mask &= sample
+    key = (tuple(fes), np.packbits(mask.to_numpy()).tobytes())
+    if key not in cache:
+        cache[key] = Demeaner(df[mask], fes)
+    demeaned = cache[key]
+    # Omit regressors collinear with fixed effects
+    X = demeaned(regressors)
+    keep = X.std(axis=0) > 1e-9
+    regressors = [r for r, k in zip(regressors, keep) if k]
+    instruments = ([instrument] if instrument else []) + \
+        [e for e in exog if e in regressors]
+    X = X[:, keep]
+    Y = demeaned([y])[:, 0]
+    Xhat = X
+    if instrument:
+        Z = demeaned(instruments)
+        Xhat = Z @ np.linalg.lstsq(Z, X, rcond=None)[0]
+    bread = np.linalg.pinv(Xhat.T @ Xhat, rcond=1e-10)
+    beta = bread @ (Xhat.T @ Y)
+    u = Y - X @ beta
+    # Inference
+    codes = [encode(df.loc[mask, c].to_numpy()) for c in clusters]
+    n_obs = Y.shape[0]
+    dof = (n_obs, X.shape[1] + demeaned.n_absorbed) if small else None
+    vcov = cluster_vcov(Xhat, u, bread, codes, dof)
+    with np.errstate(invalid="ignore"):
+        se = np.sqrt(np.diag(vcov))
+        stat = np.abs(beta/se)
+    if small:
+        p = 2*t.sf(stat, min(c.max()+1 for c in codes) - 1)
+    else:
+        p = 2*norm.sf(stat)
+    res = {"depvar": y, "fes": fes, "N": n_obs, "N_adv": codes[0].max()+1,
+           "mean": df.loc[mask, y].mean(),
+           "params": pd.Series(beta, index=regressors),
+           "se": pd.Series(se, index=regressors),
+           "p": pd.Series(p, index=regressors)}
+    if instrument:
+        first = estimate(df, endog, [instrument] + exog, fes=fes,
+                         clusters=clusters, sample=mask, small=small,
+                         cache=cache)
+        res["first"] = first
+        res["F_eff"] = (first["params"].get(instrument, np.nan) /
+                        first["se"].get(instrument, np.nan))**2
+    return res
+
+
+def prepare(df):
+    """Construct variables used in the regressions."""
+    df = df.dropna(subset=[CENTR]).copy()
+    df["stu_female"] = (df["stu_sex"] == "female").astype(float)
+    df.loc[df["stu_sex"].isna(), "stu_female"] = np.nan
+    df["diffrank"] = df["change_rank-w"] - df["plc_rank-w"]
+    df["changejobtime"] = df["change_year"] - df["plc_year"]
+    # As in Stata, where missing ranks count as worse
+    df["diffrankdummy"] = (~(df["diffrank"] <= 0)).astype(float)
+    df["centralitydeathshock_adv"] = df[CENTR + "_d"] - df[CENTR]
+    df.loc[df["third_dec"].between(1, 5, "neither"), "third_dec"] = 1
+    # Polynomials and interactions
+    df["school_rank-w2"] = df["school_rank-w"]**2
+    df["school_rank-w3"] = df["school_rank-w"]**3
+    df["school_rank-w_x_centr"] = df["school_rank-w"] * df[CENTR]
+    df["adv_experience2"] = df["adv_experience"]**2
+    df["adv_experience_x_adv_euclid"] = df["adv_experience"] * df["adv_euclid"]
+    for q in range(2, 5):
+        euclid_q = (df["adv_euclid_quartile"] == q).astype(float)
+        df[f"adv_euclid_quartile_{q}"] = euclid_q
+        df[f"adv_experience_x_adv_euclid_quartile_{q}"] = \
+            df["adv_experience"] * euclid_q
+        exp_q = (df["adv_experience_quartile"] == q).astype(float)
+        df[f"adv_experience_quartile_{q}"] = exp_q
+        for r in range(2, 5):
+            df[f"adv_experience_quartile_{q}_x_adv_euclid_quartile_{r}"] = \
+                exp_q * (df["adv_euclid_quartile"] == r)
+    return df
+
+
+def write_table(models, fname, order=(), drop="quartile",
+                fixed_effects=INDICATORS, labels=LABELS, mean=False):
+    """Write estimation results to a LaTeX table in the layout of esttab."""
+    def row(label, cells):
+        cells = [f"{c:^23}" for c in cells]
+        return f"{label:<30}\t&" + "\t&".join(cells) + "\\\\"
+
+    def stars(p):
+        return "\\sym{" + "*"*sum(p < a for a in (0.1, 0.05, 0.01)) + "}" \
+            if p < 0.1 else ""
+
+    n = len(models)
+    variables = list(order)
+    for m in models:
+        variables.extend(v for v in m["params"].index if v not in variables)
+    variables = [v for v in variables if not (drop and drop in v)]
+    lines = ["{", "\\def\\sym#1{\\ifmmode^{#1}\\else\\(^{#1}\\)\\fi}",
+             f"\\begin{{tabular}}{{l*{{{n}}}{{D{{.}}{{.}}{{-1}}}}}}",
+             "\\toprule",
+             row("", [f"\\multicolumn{{1}}{{c}}{{({i})}}" for i in range(1, n+1)]),
+             row("", ["\\multicolumn{1}{c}{" + labels.get(m["depvar"],
+                                                         m["depvar"]) + "}"
+                      for m in models]),
+             "\\midrule"]
+    for var in variables:
+        coefs, ses = [], []
+        for m in models:
+            if var in m["params"] and np.isfinite(m["params"][var]):
+                coefs.append(f"{m['params'][var]:.3f}{stars(m['p'][var])}")
+                ses.append(f"({m['se'][var]:.3f})")
+            else:
+                coefs.append("")
+                ses.append("")
+        lines.extend([row(labels.get(var, var), coefs), row("", ses),
+                      "\\addlinespace"])
+    for fe, label in fixed_effects.items():
+        if any(fe in m["fes"] for m in models):
+            cells = ["\\checkmark" if fe in m["fes"] else "" for m in models]
+            lines.extend([row(label, cells), "\\addlinespace"])
+    lines[-1] = "\\midrule"
+    lines.append(row("N", [f"{m['N']:,}" for m in models]))
+    lines.append(row("\\# of advisers", [f"{m['N_adv']:,}" for m in models]))
+    if mean:
+        lines.append(row("Mean", [f"{m['mean']:.3f}" for m in models]))
+    if any("F_eff" in m for m in models):
+        lines.append(row("Effective F", [f"{m['F_eff']:,.1f}" if "F_eff" in m
+                                         else "" for m in models]))
+    lines.extend(["\\bottomrule",
+                  f"\\multicolumn{{{n+1}}}{{l}}{{\\footnotesize \\sym{{*}} "
+                  "\\(p<0.1\\), \\sym{**} \\(p<0.05\\), \\sym{***} \\(p<0.01\\)}\\\\",
+                  "\\end{tabular}", "}"])
+    (OUTPUT_FOLDER/"Tables"/fname).write_text("\n".join(lines) + "\n")
+
+
+def main():
+    df = prepare(pd.read_csv(SOURCE_FILE))
+    cache = {}
+
+    def est(y, exog, **kwds):
+        return estimate(df, y, exog, cache=cache, **kwds)
+
+    # Student citations
+    occ = df["adv_occ"] > 1
+    controls = CONTROLS + ["plc_rank-w"]
+    models = [est("stu_citestock_5p", [CENTR] + controls, small=True),
+              est("stu_citestock_5p", [CENTR] + controls, sample=occ, small=True),
+              est("stu_citestock_5p", controls, endog=CENTR, instrument=FIRST,
+                  sample=occ)]
+    write_table(models, "centrality_reg_stucitation.tex")
+
+    # Adviser distance
+    models = [est("adv_dist", CONTROLS, endog=CENTR, instrument=inst, sample=occ)
+              for inst in (FIRST, SECOND)]
+    write_table(models, "centrality_2sls_distance.tex", order=[CENTR])
+
+    # Keep students of advisers with two placements in different years
+    sample = occ & df["plc_score-w-std"].notnull()
+    y = "plc_score-w-std"
+
+    # OLS Baseline
+    models = [est(y, [var] + CONTROLS, sample=sample, small=True)
+              for var in (CENTR, FIRST, SECOND)]
+    write_table(models, "centrality_ols_baseline.tex",
+                order=[CENTR, FIRST, SECOND])
+
+    # 2SLS IV Baseline
+    models = [est(y, CONTROLS, endog=CENTR, instrument=inst, sample=sample)
+              for inst in (FIRST, SECOND)]
+    write_table([m["first"] for m in models] + models,
+                "centrality_2sls_baseline.tex", order=[CENTR, FIRST, SECOND])
+
+    # Adviser citations
+    citations = ["citestock_growth9699", "citestock_growth3", "citeflow_growth1"]
+    models = [est(y, citations + CONTROLS, endog=CENTR, instrument=inst,
+                  sample=sample) for inst in (FIRST, SECOND)]
+    write_table(models, "centrality_2sls_advcitation.tex")
+
+    # Centrality leads
+    models = [est(y, CONTROLS, endog=f"{CENTR}_l{lead}",
+                  instrument=f"{inst}_l{lead}", sample=sample)
+              for inst in (FIRST, SECOND) for lead in (1, 2)]
+    write_table(models, "centrality_2sls_leads.tex",
+                order=[CENTR + "_l1", CENTR + "_l2"])
+
+    # Experience interacted with Euclid
+    fes = ["best_adviser", "stu_jel", "stu_year"]
+    experience = ["adv_experience", "adv_experience2"]
+    euclid_q = [f"adv_euclid_quartile_{q}" for q in range(2, 5)]
+    exp_euclid_q = [f"adv_experience_x_{c}" for c in euclid_q]
+    exp_q = [f"adv_experience_quartile_{q}" for q in range(2, 5)]
+    exp_q_euclid_q = [f"{e}_x_{c}" for e in exp_q for c in euclid_q]
+    specs = [["adv_experience_x_adv_euclid"] + experience,
+             experience + euclid_q + exp_euclid_q,
+             experience + exp_q + euclid_q + exp_q_euclid_q]
+    models = [est(y, CONTROLS + spec, endog=CENTR, instrument=FIRST,
+                  fes=fes, sample=sample) for spec in specs]
+    fixed_effects = {k: v for k, v in INDICATORS.items() if k in fes}
+    write_table(models, "centrality_2sls_experience-euclid.tex",
+                fixed_effects=fixed_effects)
+
+    # Centrality after deaths
+    deaths = ["first_dec", "second_dec", "third_dec"]
+    iv = est(y, CONTROLS + deaths, endog=CENTR, instrument=FIRST, sample=sample)
+    ols = est(y, ["centralitydeathshock_adv"] + CONTROLS, sample=sample, small=True)
+    write_table([iv["first"], iv, ols], "centrality_reg_death.tex",
+                order=[CENTR, FIRST, "centralitydeathshock_adv"])
+
+    # Degree
+    iv = est(y, CONTROLS, endog="adv_deg", instrument="first_deg_mean",
+             sample=sample)
+    models = [est(y, [var] + CONTROLS, sample=sample, small=True)
+              for var in ("adv_deg", "first_deg_mean")]
+    write_table([iv["first"], iv] + models, "centrality_reg_degree.tex",
+                order=["adv_deg", "first_deg_mean"])
+
+    # 2SLS IV on second placement
+    change = sample & (df["changejobtime"] < 8)
+    controls = ["adv_euclid", "stu_female", "school_score-w", "plc_score-w"]
+    models = [est(dep, controls, endog=CENTR, instrument=FIRST, sample=change)
+              for dep in ("diffrankdummy", "diffrank")]
+    write_table(models, "centrality_2sls_change.tex")
+
+    # School rank polynomials
+    polynomials = [["school_rank-w2"], ["school_rank-w2", "school_rank-w3"]]
+    models = [est(y, CONTROLS + poly, endog=CENTR, instrument=FIRST,
+                  sample=sample) for poly in polynomials]
+    write_table([m["first"] for m in models] + models,
+                "centrality_2sls_polynomials.tex", order=[CENTR, FIRST])
+
+    # School rank sample splits
+    quartile = df["school_rank-w_quartile"]
+    splits = [quartile.isin([1, 2]), quartile.isin([3, 4])]
+    splits.extend(quartile == q for q in range(1, 5))
+    models = [est(y, CONTROLS, endog=CENTR, instrument=FIRST,
+                  sample=sample & split) for split in splits]
+    write_table(models, "centrality_2sls_splits.tex")
+
+    # Interactions
+    interaction = [CENTR, "school_rank-w_x_centr", "school_rank-w2",
+                   "school_rank-w3"]
+    models = [est(y, interaction + CONTROLS, sample=sample, small=True)]
+    write_table(models, "centrality_ols_interactions.tex")
+
+
+if __name__ == '__main__':
+    main()
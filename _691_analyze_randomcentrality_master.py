@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
+"""Estimates the main 2SLS specification on all random assignments of
+advisers to students.
+
+Student-side variables are encoded once for the stacked panel of all
+draws; per draw only the sample and the adviser-dependent variables change.
+Fixed effects are absorbed by alternating projections, and standard errors
+are clustered two-way by adviser and PhD school.  The student fixed effects
+are partialled out of the student-side variables once for all draws, so
+that the projections per draw mostly work on the adviser-dependent
+variables.
+
+The main specification is also estimated on the actual assignment, whose
+p value is the reference for the random ones.  With STREAM = True, random
+assignments of both schemes are instead sampled, merged and estimated
+batch-wise in memory, and sampling stops as soon as the confidence interval
+of the randomization p value lies entirely on one side of ALPHA.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.stats import beta as beta_dist, norm
+from tqdm import tqdm
+
+from _005_parse_students import read_registry, student_keys
+from _199_map_advisers_to_students import SEED, read_pool
+from _680_create_centrality_masters import make_lookup, read_random_inputs,\
+    read_random_masters, stack_draws
+from _690_analyze_centrality_master import absorb, cluster_vcov, encode
+
+ACTUAL_FILE = Path("./680_centrality_masters/master.csv")
+TARGET_FOLDER = Path("./691_random_results/")
+
+MAX_WORKERS = 4  # No. of parallel processes
+DRAWS_PER_FILE = 100  # No. of estimations per results file for distribution
+
+# Specification
+DEPVAR = "plc_score-w-std"
+ENDOG = "adv_ev-w-win99-std"
+INSTRUMENT = "first_ev-w-win99-std_mean"
+EXOG = ["adv_euclid", "stu_male", "school_rank-w"]
+FIXED_EFFECTS = ["adviser", "adv_experience", "stu_year", "stu_jel"]
+CLUSTERS = ["adviser", "stu_school"]
+MIN_OCC = 1  # Keep only advisers with more occurrences
+STUDENT_VARS = [DEPVAR, "stu_male", "school_rank-w"]  # Equal in all draws
+STUDENT_FES = ["stu_year", "stu_jel"]
+
+# Sequential randomization inference
+STREAM = False  # Sample and estimate draws in memory instead of reading them
+ALPHA = 0.05  # Decision threshold for the randomization p value
+CONFIDENCE = 0.99  # Confidence level of interval around randomization p value
+BATCH_SIZE = 50  # No. of draws sampled at once
+MIN_DRAWS = 100
+MAX_DRAWS = 10_000
+
+# Labels in results files
+LABELS = {"adv_ev-w-win99-std": "adv_evwwin99std", "adv_euclid": "adv_euclid",
+          "stu_male": "2.stu_sex", "school_rank-w": "school_rankw"}
+INDICATORS = ["Adviser FE ", "Adviser experience FE", "Field FE ",
+              "Placement year FE "]
+
+
+def clopper_pearson(k, n, confidence=CONFIDENCE):
+    """Compute exact confidence interval for a share of k out of n."""
+    a = (1-confidence)/2
+    lower = beta_dist.ppf(a, k, n-k+1) if k > 0 else 0.0
+    upper = beta_dist.ppf(1-a, k+1, n-k) if k < n else 1.0
+    return lower, upper
+
+
+def estimate_2sls(y, x, z, W, fes, clusters):
+    """Estimate 2SLS of y on endogenous x instrumented by z and exogenous
+    variables W, absorbing fixed effects fes.
+    """
+    fes = [encode(codes) for codes in fes]
+    data = absorb(np.column_stack([y, x, z, W]), fes)
+    y, X, Z = data[:, 0], data[:, [1] + list(range(3, data.shape[1]))], data[:, 2:]
+    Xhat = Z @ np.linalg.lstsq(Z, X, rcond=None)[0]
+    bread = np.linalg.pinv(Xhat.T @ Xhat)
+    beta = bread @ (Xhat.T @ y)
+    u = y - X @ beta
+    vcov = cluster_vcov(Xhat, u, bread, clusters)
+    with np.errstate(invalid="ignore"):
+        se = np.sqrt(np.diag(vcov))
+    p = 2*norm.sf(np.abs(beta/se))
+    return beta, p
+
+
+def partial_out_students(panel):
+    """Partial student fixed effects out of student-side variables once
+    for all draws of the panel.
+
+    Subtracting fixed effects that enter the regression of every draw
+    leaves the absorbed variables unchanged whatever the sample of the
+    draw, so the result is exact while the alternating projections per
+    draw need fewer iterations.
+    """
+    students = panel.drop_duplicates("stu_key")
+    fes = [encode(students[c].to_numpy()) for c in STUDENT_FES]
+    resid = absorb(students[STUDENT_VARS].to_numpy(dtype="float64"), fes)
+    return resid[pd.Index(students["stu_key"]).get_indexer(panel["stu_key"])]
+
+
+def prepare_panel(panel):
+    """Encode variables of stacked panel once and split into draws."""
+    panel = panel[panel["adv_occ"] > MIN_OCC].sort_values("draw", kind="stable")
+    panel["stu_male"] = (panel["stu_sex"] == "male").astype(float)
+    panel.loc[panel["stu_sex"].isna(), "stu_male"] = np.nan
+    cont = [DEPVAR, ENDOG, INSTRUMENT] + EXOG
+    cat = sorted(set(FIXED_EFFECTS + CLUSTERS))
+    panel = panel.dropna(subset=cont + cat)
+    codes = {c: pd.factorize(panel[c])[0] for c in cat}
+    values = panel[cont].to_numpy(dtype="float64")
+    values[:, [cont.index(c) for c in STUDENT_VARS]] = partial_out_students(panel)
+    bounds = np.flatnonzero(np.diff(panel["draw"].to_numpy())) + 1
+    for idx in np.split(np.arange(panel.shape[0]), bounds):
+        if not idx.size:
+            continue
+        yield {"values": values[idx],
+               "fes": [codes[c][idx] for c in FIXED_EFFECTS],
+               "clusters": [codes[c][idx] for c in CLUSTERS]}
+
+
+def run_draw(draw):
+    """Estimate main specification on one draw."""
+    v = draw["values"]
+    beta, p = estimate_2sls(v[:, 0], v[:, 1], v[:, 2], v[:, 3:], draw["fes"],
+                            draw["clusters"])
+    return beta, p, v.shape[0]
+
+
+def read_actual():
+    """Read master file of the actual assignment in the layout of the
+    random masters.
+    """
+    df = pd.read_csv(ACTUAL_FILE)
+    df.insert(0, "stu_key", student_keys(df.pop("stu_id"), read_registry()))
+    df.insert(0, "draw", 0)
+    return df.rename(columns={"best_adviser": "adviser"})
+
+
+def run_sequential(scheme, p_actual, max_workers=MAX_WORKERS):
+    """Estimate main specification on freshly sampled draws of random
+    assignment `scheme` until the share of draws with p values at most
+    `p_actual` is settled.
+    """
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for panel in stream_draws(scheme):
+            results.extend(executor.map(run_draw, prepare_panel(panel)))
+            n = len(results)
+            k = sum(p[0] <= p_actual for _, p, _ in results)
+            lower, upper = clopper_pearson(k, n)
+            print(f"... {n:,} draws: randomization p value {k/n:.3f} "
+                  f"[{lower:.3f}, {upper:.3f}]")
+            settled = upper < ALPHA or lower > ALPHA
+            if (n >= MIN_DRAWS and settled) or n >= MAX_DRAWS:
+                break
+    return results
+
+
+def run_scheme(scheme, max_workers=MAX_WORKERS):
+    """Estimate main specification on all draws of random assignment
+    `scheme` in parallel.
+    """
+    panel = read_random_masters(scheme)
+    draws = list(prepare_panel(panel))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(tqdm(executor.map(run_draw, draws, chunksize=10),
+                            total=len(draws)))
+    return results
+
+
+def stream_draws(scheme, batch_size=BATCH_SIZE, seed=SEED):
+    """Sample random assignments of `scheme` batch-wise and yield the
+    stacked master panel of each batch.
+    """
+    df, adv_year = read_random_inputs()
+    students, advisers, sampler = read_pool(scheme)
+    students = student_keys(students, read_registry())
+    years = pd.Index(sorted(df["stu_year"].unique()))
+    lookup = make_lookup(adv_year.index, advisers, years)
+    for batch in count():
+        draws = sampler(batch_size, seed=[seed, batch])
+        yield stack_draws(df, adv_year, lookup, years, draws, students,
+                          advisers, first_draw=batch*batch_size)
+
+
+def write_results(results, fname):
+    """Write coefficients and p values in the layout of esttab."""
+    def fmt(x):
+        return f'="{x:.3g}"' if np.isfinite(x) else '=""'
+    n_models = len(results)
+    lines = [[""] + [f"({i})" for i in range(1, n_models+1)],
+             [""] + ["plc_scorewstd"]*n_models]
+    lines = [",".join(f'="{c}"' for c in line) for line in lines]
+    for i, var in enumerate([ENDOG] + EXOG):
+        lines.append(",".join([f'="{LABELS[var]}"'] +
+                              [fmt(beta[i]) for beta, _, _ in results]))
+        lines.append(",".join(['=""'] +
+                              [f'="{p[i]:.3f}"' for _, p, _ in results]))
+    for label in INDICATORS:
+        lines.append(",".join([f'="{label}"'] + ['="Yes"']*n_models))
+    lines.append(",".join(['="N"'] + [f'="{n}"' for _, _, n in results]))
+    fname.write_text("\n".join(lines) + "\n")
+
+
+def main():
+    TARGET_FOLDER.mkdir(exist_ok=True)
+
+    # Actual assignment
+    print(">>> Estimating actual assignment")
+    actual = run_draw(next(prepare_panel(read_actual())))
+    write_results([actual], TARGET_FOLDER/"actual.csv")
+    p_actual = round(actual[1][0], 3)  # As written and plotted
+    print(f"... p value of {ENDOG}: {p_actual}")
+
+    if STREAM:
+        for scheme in ("distribution", "field"):
+            print(f">>> Estimating sampled assignments with actual {scheme}")
+            results = run_sequential(scheme, p_actual)
+            write_results(results, TARGET_FOLDER/f"sequential_{scheme}.csv")
+        return
+
+    # Random assignments with actual distribution
+    print(">>> Estimating assignments with actual distribution")
+    results = run_scheme("distribution")
+    for i in range(0, len(results), DRAWS_PER_FILE):
+        fname = TARGET_FOLDER/f"distribution{i//DRAWS_PER_FILE}.csv"
+        write_results(results[i:i+DRAWS_PER_FILE], fname)
+
+    # Random assignments with actual field
+    print(">>> Estimating assignments with actual field")
+    results = run_scheme("field")
+    write_results(results, TARGET_FOLDER/"field.csv")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
+"""Computes wild cluster bootstrap p values for adviser centrality in the
+main OLS and 2SLS specifications on the centrality master.
+
+The bootstrap imposes the null hypothesis (WCR): bootstrap outcomes are
+restricted fitted values plus restricted residuals multiplied by one
+weight per bootstrap cluster, the intersection of adviser and PhD school.
+Both the bootstrap coefficient and its
+two-way clustered standard error are linear in these weights, so the
+cluster-level score contributions are computed once and each batch of
+replications reduces to matrix products with a weight matrix.  For 2SLS
+the first stage is held fixed.  Batches of replications are spread across
+processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from _690_analyze_centrality_master import CENTR, CONTROLS, CLUSTERS,\
+    FIRST, FIXED_EFFECTS, SECOND, SOURCE_FILE, Demeaner, encode, prepare
+
+TARGET_FILE = Path("./692_bootstrap_results/bootstrap.csv")
+
+MAX_WORKERS = 4  # No. of parallel processes
+N_REPS = 9_999  # No. of bootstrap replications
+BATCH_SIZE = 1_000  # No. of replications per weight matrix
+SEED = 0
+DEPVAR = "plc_score-w-std"
+
+_PROBLEM = {}  # Precomputed contributions in worker processes
+
+WEBB = np.array([-np.sqrt(1.5), -1, -np.sqrt(0.5),
+                 np.sqrt(0.5), 1, np.sqrt(1.5)])
+
+
+def bootstrap_batch(n_reps, seed, weights="rademacher"):
+    """Compute bootstrap t statistics for one batch of replications."""
+    rng = np.random.default_rng(seed)
+    n_clusters = _PROBLEM["numer"].shape[0]
+    if weights == "webb":
+        v = WEBB[rng.integers(0, 6, size=(n_clusters, n_reps))]
+    else:
+        v = rng.integers(0, 2, size=(n_clusters, n_reps))*2.0 - 1
+    return t_stats(v, **_PROBLEM)
+
+
+def init_worker(problem):
+    """Store precomputed contributions in worker process."""
+    _PROBLEM.update(problem)
+
+
+def make_problem(df, instrument=None):
+    """Compute bootstrap contributions of OLS of the main specification, or
+    2SLS if `instrument` is given, on its estimation sample.
+
+    As in _690's estimate(), the sample excludes observations with missing
+    values in any variable of the model.
+    """
+    cols = [DEPVAR, CENTR] + CONTROLS + FIXED_EFFECTS + CLUSTERS
+    if instrument:
+        cols.append(instrument)
+    df = df[df[cols].notnull().all(axis=1)]
+    demeaned = Demeaner(df, FIXED_EFFECTS)
+    y = demeaned([DEPVAR])[:, 0]
+    X = demeaned([CENTR] + CONTROLS)
+    X_r = X[:, 1:]
+    Xhat = X
+    if instrument:
+        Z = np.column_stack([demeaned([instrument]), X_r])
+        Xhat = Z @ np.linalg.lstsq(Z, X, rcond=None)[0]
+    clusters = [encode(df[c].to_numpy()) for c in CLUSTERS]
+    boot = encode(clusters[0]*(clusters[1].max()+1) + clusters[1])
+    problem = precompute(y, X, Xhat, X_r, boot, clusters)
+    return problem, df.shape[0], boot.max()+1
+
+
+def precompute(y, X, Xhat, X_r, boot, clusters):
+    """Compute cluster-level contributions to the bootstrap coefficient of
+    the first regressor and to its cluster-robust variance.
+
+    For bootstrap cluster weights v, the bootstrap coefficient equals
+    numer @ v, and for each (factor, K) in denom the scores of one
+    combination of clustering dimensions equal K @ v.
+    """
+    bread = np.linalg.pinv(Xhat.T @ Xhat, rcond=1e-10)
+    A = bread @ Xhat.T
+    u_r = y - X_r @ np.linalg.lstsq(X_r, y, rcond=None)[0]
+    n_obs, n_boot = y.shape[0], boot.max()+1
+    rows = np.arange(n_obs)
+    # Restricted residual contributions by bootstrap cluster
+    B = sparse.csr_matrix((u_r, (rows, boot)), shape=(n_obs, n_boot))
+    numer = np.asarray(B.T @ A[0])
+    E = (B.T @ A.T).T
+    denom = []
+    for n_dims in range(1, len(clusters)+1):
+        sign = (-1)**(n_dims+1)
+        for combo in combinations(clusters, n_dims):
+            codes = combo[0]
+            for other in combo[1:]:
+                codes = encode(codes*(other.max()+1) + other)
+            n_groups = codes.max()+1
+            G = sparse.csr_matrix((A[0], (codes, rows)),
+                                  shape=(n_groups, n_obs))
+            K = (G @ B).toarray() - (G @ X) @ E
+            factor = sign * n_groups/(n_groups-1)
+            denom.append((factor, K))
+    return {"numer": numer, "denom": denom}
+
+
+def read_sample():
+    """Read centrality master and restrict to students of advisers with
+    several placements and with a placement score, as in _690.
+    """
+    df = prepare(pd.read_csv(SOURCE_FILE))
+    mask = (df["adv_occ"] > 1) & df[DEPVAR].notnull()
+    return df[mask].reset_index(drop=True)
+
+
+def run_bootstrap(problem, weights="rademacher", n_reps=N_REPS,
+                  batch_size=BATCH_SIZE, seed=SEED, max_workers=MAX_WORKERS):
+    """Compute bootstrap p value of the first regressor in parallel."""
+    t_actual = t_stats(np.ones((problem["numer"].shape[0], 1)), **problem)[0]
+    sizes = [min(batch_size, n_reps-i) for i in range(0, n_reps, batch_size)]
+    seeds = [[seed, i] for i in range(len(sizes))]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                             initargs=(problem,)) as executor:
+        t_boot = np.concatenate(list(executor.map(
+            bootstrap_batch, sizes, seeds, [weights]*len(sizes))))
+    t_boot = t_boot[np.isfinite(t_boot)]
+    p = (np.abs(t_boot) >= np.abs(t_actual)).mean()
+    return t_actual, p, t_boot.shape[0]
+
+
+def t_stats(v, numer, denom):
+    """Compute t statistics for bootstrap cluster weights v."""
+    beta = numer @ v
+    var = sum(factor * ((K @ v)**2).sum(axis=0) for factor, K in denom)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(var > 0, beta/np.sqrt(var), np.nan)
+
+
+def main():
+    df = read_sample()
+
+    # Compute p values
+    specs = {"OLS": None, f"2SLS {FIRST}": FIRST, f"2SLS {SECOND}": SECOND}
+    out = []
+    for model, inst in specs.items():
+        problem, n_obs, n_boot = make_problem(df, inst)
+        print(f">>> Bootstrapping {model} on {n_obs:,} observations in "
+              f"{n_boot:,} bootstrap clusters")
+        for weights in ("rademacher", "webb"):
+            t_actual, p, n_reps = run_bootstrap(problem, weights)
+            print(f"... {weights} weights: t = {t_actual:.3f}, p = {p:.4f}")
+            out.append({"model": model, "weights": weights, "t": t_actual,
+                        "p": p, "reps": n_reps, "N": n_obs})
+
+    # Write out
+    TARGET_FILE.parent.mkdir(exist_ok=True)
+    pd.DataFrame(out).to_csv(TARGET_FILE, index=False)
+
+
+if __name__ == '__main__':
+    main()
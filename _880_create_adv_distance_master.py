@@ -1,50 +1,121 @@
 #!/usr/bin/env python3
 # Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
-"""Creates master file for regression in advisor-department network."""
+"""Creates master file for regression in advisor-department network.
+
+The adviser-department panel is built one year at a time: each year's
+distance files pass through the full join chain and are written to their
+own file in 880_distance_masters/adviser/.  Scopus IDs are anonymised in a
+second pass over the year files, once the IDs of all years are known.
+"""
 
-from string import ascii_lowercase
-from itertools import combinations_with_replacement as cwr
 from pathlib import Path
 
 import pandas as pd
 from tqdm import tqdm
 
-from _680_create_centrality_masters import read_agg_centr
+from _005_parse_students import read_registry, student_keys
+from _401_rank_institutions import WINDOW, read_ranking
+from _680_create_centrality_masters import anonymize, read_agg_centr
 
 MAPPING_FILE = Path("./090_institution_data/mapping.csv")
 ADVISERSTUDENT_MAP = Path("./199_adviser-student_map/actual.csv")
 FACULTY_FILE = Path("./117_faculty_lists/hasselback.csv")
 STUDENT_FILE = Path("./615_student_data/student.csv")
 ADVISER_FILE = Path("./625_adviser_data/adviser.csv")
-TARGET_FILE = Path("./880_distance_masters/adviser.csv")
+DISTANCE_FOLDER = Path("./217_placement_distance/")
+TARGET_FOLDER = Path("./880_distance_masters/")
+TARGET_FILE = TARGET_FOLDER/"adviser.csv"
+YEAR_FOLDER = TARGET_FOLDER/"adviser"
+
+EXPORT_CSV = True  # Also write all years to one CSV file (read by Stata)
+ANONYMIZE = ["plc_scopus", "school_scopus", "adv_scopus"]
 
 CUNY = {"CUNY, BARUCH COLLEGE", "CUNY, BROOKLYN COLLEGE",
         "CUNY, HUNTER COLLEGE", "CUNY, QUEENS COLLEGE"}
 
 
-def read_distance_files():
-    """Read all distance files and stack on top of each other."""
-    dist = {"coauthor": [], "citation": []}
-    files = sorted(Path("./217_placement_distance/").glob("*.csv"))
-    for file in tqdm(files):
-        new = pd.read_csv(file, index_col=['university', 'adviser'])
-        base, network, year = file.stem.split("_")
-        new = new.add_prefix(network + "_")
-        new["year"] = int(year)
-        dist[network].append(new)
-    coauthor = pd.concat(dist["coauthor"]).set_index("year", append=True)
-    citation = pd.concat(dist["citation"]).set_index("year", append=True)
-    df = coauthor.join(citation)
+def list_years(folder=DISTANCE_FOLDER):
+    """List years with coauthor distance files."""
+    files = folder.glob("*_coauthor_*.csv")
+    return sorted(int(f.stem.split("_")[-1]) for f in files)
+
+
+def merge_year(dist, hiring, matrix, data, adv_school, centr, mapping, ranks,
+               schools):
+    """Merge placement, adviser and school information onto the
+    distances of one year.
+    """
+    # Merge placement ranks
+    dist = dist.join(ranks, on=["plc_scopus", "year"])
+    rename = {"score-w": "plc_score-w", "year": "stu_year"}
+    dist = dist.rename(columns=rename)
+    dist["hiring"] = dist["plc_scopus"].isin(hiring)*1
+    dist["hiring"] = dist["hiring"].astype(str).replace({"0": None})
+
+    # Add placement indicator
+    cols = ["adv_scopus", "stu_year", "plc_scopus"]
+    # Drop adviser-years w/o known placements of their students
+    dist = dist.join(matrix.set_index(cols[:2]), how="inner", on=cols[:2],
+                     rsuffix="_")
+    dist = (dist.drop_duplicates(subset=cols)
+                .drop(columns="plc_scopus_"))
+    matrix = matrix.dropna().set_index(cols)
+    matrix["extensive"] = 1
+    out = dist.join(matrix, how="left", on=cols)
+
+    # Merge adviser data
+    out = out.join(data, how="inner", on=["adv_scopus", "stu_year"])
+    out = out.join(adv_school, how="left", on="adv_scopus")
+
+    # Add adviser centrality
+    out = out.join(centr, how="left", on=["adv_scopus", "stu_year"])
+
+    # Merge school ranks
+    out = (out.join(mapping, on="stu_school")
+              .drop(columns="stu_school"))
+    out = out.join(ranks, on=["school_scopus", "stu_year"])
+    out = out.rename(columns={"rank-w": "school_rank-w", "score-w": "school_score-w"})
+
+    # School-specific variables
+    out['plc_phd'] = out['plc_scopus'].isin(schools)*1
+    return out
+
+
+def read_distance_files(year, folder=DISTANCE_FOLDER):
+    """Read coauthor and citation distance files of one year."""
+    dist = {}
+    for network in ("coauthor", "citation"):
+        files = list(folder.glob(f"*_{network}_{year}.csv"))
+        if not files:  # Take columns from any other year
+            files = list(folder.glob(f"*_{network}_*.csv"))[:1]
+            new = pd.read_csv(files[0], index_col=['university', 'adviser'],
+                              nrows=0)
+        else:
+            new = pd.read_csv(files[0], index_col=['university', 'adviser'])
+        dist[network] = new.add_prefix(network + "_")
+    df = dist["coauthor"].join(dist["citation"])
     rename = {"university": "plc_scopus", "adviser": "adv_scopus"}
     df = df.reset_index().rename(columns=rename)
+    df.insert(2, "year", year)
     df["year"] = df["year"].astype("uint16")
     return df
 
 
-def read_rankings():
-    """Read our version of the rankings."""
-    folder = Path("./401_institution_rankings")
-    ranks = pd.read_csv(folder/"weighted.csv", encoding="utf")
+def read_distance_master(years=None, folder=YEAR_FOLDER):
+    """Read adviser-department master, optionally only for selected
+    years.
+    """
+    files = sorted(folder.glob("*.parquet"))
+    if years is not None:
+        files = [f for f in files if int(f.stem) in years]
+    return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+
+
+def read_rankings(window=WINDOW):
+    """Read our version of the rankings based on publications over `window`
+    years.
+    """
+    ranks = read_ranking("weighted", window)
     ranks["institution"] = ranks["institution"].astype(object)
     return (ranks.set_index(["institution", "year"])
                  .drop(columns="rank")
@@ -54,20 +125,22 @@ def read_rankings():
 def main():
     # Read student file
     print(">>> Reading student data")
-    cols = ["stu_id", "stu_school", "stu_year", "stu_plc", "plc_scopus"]
-    df = pd.read_csv(STUDENT_FILE, usecols=cols, index_col=0)
+    registry = read_registry()
+    cols = ["stu_id", "stu_plc", "plc_scopus"]
+    df = pd.read_csv(STUDENT_FILE, usecols=cols)
+    df.index = pd.Index(student_keys(df.pop("stu_id"), registry), name="stu_key")
     df = df.dropna(subset=["stu_plc"]).drop(columns="stu_plc")
     hiring = df["plc_scopus"].unique()
-    df["stu_year"] = df["stu_year"].astype("uint16")
-    df["stu_school"] = df["stu_school"].str.upper()
-    adviser_map = pd.read_csv(ADVISERSTUDENT_MAP, index_col="stu_id",
-                              usecols=["stu_id", "adv_scopus"])
-    df = df.join(adviser_map)
+    df = df.join(registry[["stu_school", "stu_year"]])
+    df["stu_school"] = df["stu_school"].astype(str).str.upper()
+    adviser_map = pd.read_csv(ADVISERSTUDENT_MAP, usecols=["stu_id", "adv_scopus"])
+    adviser_map.index = student_keys(adviser_map.pop("stu_id"), registry)
+    df = df.join(adviser_map[adviser_map.index >= 0])
 
     # Transform to adviser-placement information
-    adv = df.reset_index()[["stu_id", "adv_scopus", "stu_year"]]
+    adv = df.reset_index()[["stu_key", "adv_scopus", "stu_year"]]
     adv = (adv.dropna(subset=['adv_scopus'])
-              .set_index(['stu_id', 'stu_year'])
+              .set_index(['stu_key', 'stu_year'])
               ["adv_scopus"].str.split(";", expand=True)
               .stack().reset_index(level=2, drop=True)
               .reset_index()
@@ -80,92 +153,81 @@ def main():
     data = data.dropna(subset=["adv_euclid"])
     best = (adv.join(data, how='left', on=['adv_scopus', 'stu_year'])
                .sort_values('adv_euclid', ascending=False)
-               .groupby('stu_id').head(1))
+               .groupby('stu_key').head(1))
     df = (df.drop("adv_scopus", axis=1)
-            .merge(best[['stu_id', 'adv_scopus']], "inner",
-                   left_index=True, right_on='stu_id')
-            .set_index('stu_id'))
-
-    # Read distance of each adviser to any department
-    print(">>> Reading files with distance measures")
-    dist = read_distance_files()
+            .merge(best[['stu_key', 'adv_scopus']], "inner",
+                   left_index=True, right_on='stu_key')
+            .set_index('stu_key'))
 
-    # Merge placement ranks
-    print(">>> Adding placement rankings...")
+    # Tables merged onto every year
     ranks = read_rankings()
-    dist = dist.join(ranks, on=["plc_scopus", "year"])
-    rename = {"score-w": "plc_score-w", "year": "stu_year"}
-    dist = dist.rename(columns=rename)
-    n_unranked_plc = dist[dist["plc_score-w"].isnull()]["plc_scopus"].nunique()
-    print(f"... {n_unranked_plc:,} placements (out of "
-          f"{dist['plc_scopus'].nunique():,}) without rank for at least one year")
-    dist["hiring"] = dist["plc_scopus"].isin(hiring)*1
-    dist["hiring"] = dist["hiring"].astype(str).replace({"0": None})
-
-    # Add placement indicator
     cols = ["adv_scopus", "stu_year", "plc_scopus"]
     movements = df[cols].apply(tuple, axis=1).values
     matrix = pd.DataFrame.from_records(movements).drop_duplicates()
     matrix.columns = cols
-    # Drop adviser-years w/o known placements of their students
-    dist = dist.join(matrix.set_index(cols[:2]), how="inner", on=cols[:2],
-                     rsuffix="_")
-    dist = (dist.drop_duplicates(subset=cols)
-                .drop(columns="plc_scopus_"))
-    matrix = matrix.dropna().set_index(cols)
-    matrix["extensive"] = 1
-    out = dist.join(matrix, how="left", on=cols)
-    del dist, matrix
-
-    # Merge adviser data
-    out = out.join(data, how="inner", on=["adv_scopus", "stu_year"])
-    del data
-    best["stu_school"] = best["stu_id"].str.split(";").str[1].str.upper()
+    best["stu_school"] = best["stu_key"].map(df["stu_school"])
     adv_school = (best.sort_values(["adv_scopus", "stu_year"])
                       .groupby(["adv_scopus"])["stu_school"].first())
-    out = out.join(adv_school, how="left", on="adv_scopus")
-
-    # Add adviser centrality
     centr = read_agg_centr("coauthor")
-    cols = ['adv_ev-w-win99-std', 'first_ev-w-win99-std_mean']
-    centr = centr[cols]
-    out = out.join(centr, how="left", on=["adv_scopus", "stu_year"])
-
-    # Merge school ranks
-    print(">>> Adding school rankings...")
+    centr = centr[['adv_ev-w-win99-std', 'first_ev-w-win99-std_mean']]
     mapping = pd.read_csv(MAPPING_FILE, index_col="our_name")
     mapping.index = mapping.index.str.upper()
     mapping = (mapping.dropna().astype("uint64")
                       .rename(columns={"Scopus": "school_scopus"}))
-    out = (out.join(mapping, on="stu_school")
-              .drop(columns="stu_school"))
-    out = out.join(ranks, on=["school_scopus", "stu_year"])
-    out = out.rename(columns={"rank-w": "school_rank-w", "score-w": "school_score-w"})
-    n_unranked_school = out[out["school_score-w"].isnull()]["school_scopus"].nunique()
-    print(f"... {n_unranked_school:,} schools (out of "
-          f"{out['school_scopus'].nunique():,}) without rank for at least one year")
-    del ranks
-
-    # School-specific variables
-    mapping = mapping["school_scopus"].to_dict()
+    school_map = mapping["school_scopus"].to_dict()
     schools = set(df["stu_school"].unique())
     schools.update({s.upper() for s in CUNY})
     schools.add("CLAREMONT MCKENNA COLLEGE")
     schools.remove("CLAREMONT GRADUATE UNIVERSITY")
-    schools = {mapping[s] for s in schools}
-    out['plc_phd'] = out['plc_scopus'].isin(schools)*1
-
-    # Write out
-    letters = ["".join(comb) for comb in cwr(ascii_lowercase, 3)]
-    for col in ("plc_scopus", "school_scopus", "adv_scopus"):
-        out[col] = pd.Categorical(out[col])
-        out[col] = [letters[i] for i in out[col].cat.codes]
-    out = out[~out["coauthor_d_dist"].isna()]
-    print(f">>> Saving file with {out.shape[0]:,} observations and "
-          f"{out['extensive'].sum():,.0f} positive incidences")
-    out.to_csv(TARGET_FILE, index=False)
+    schools = {school_map[s] for s in schools}
+
+    # Build master year by year
+    print(">>> Merging distance measures year by year")
+    YEAR_FOLDER.mkdir(parents=True, exist_ok=True)
+    for file in YEAR_FOLDER.glob("*.parquet"):
+        file.unlink()
+    years = list_years()
+    ids = {col: set() for col in ANONYMIZE}
+    plcs, unranked_plcs, unranked_schools = set(), set(), set()
+    for year in tqdm(years):
+        dist = read_distance_files(year)
+        out = merge_year(dist, hiring, matrix[matrix["stu_year"] == year],
+                         data, adv_school, centr, mapping, ranks, schools)
+        plcs.update(dist["plc_scopus"].unique())
+        no_rank = dist.join(ranks, on=["plc_scopus", "year"])["score-w"].isnull()
+        unranked_plcs.update(dist.loc[no_rank, "plc_scopus"])
+        no_rank = out.loc[out["school_score-w"].isnull(), "school_scopus"]
+        unranked_schools.update(no_rank.dropna())
+        for col in ANONYMIZE:
+            ids[col].update(out[col].dropna().unique())
+        out.to_parquet(YEAR_FOLDER/f"{year}.parquet", index=False)
+    print(f"... {len(unranked_plcs):,} placements (out of {len(plcs):,}) "
+          "without rank for at least one year")
+    print(f"... {len(unranked_schools):,} schools (out of "
+          f"{len(ids['school_scopus']):,}) without rank for at least one year")
+
+    # Anonymise and write out
+    categories = {col: pd.Index(sorted(values)) for col, values in ids.items()}
+    n_obs = n_positive = 0
+    n_missing = 0
+    for i, year in enumerate(years):
+        fname = YEAR_FOLDER/f"{year}.parquet"
+        out = pd.read_parquet(fname)
+        for col in ANONYMIZE:
+            out[col] = anonymize(out[col], categories[col])
+        out = out[~out["coauthor_d_dist"].isna()]
+        out["hiring"] = out["hiring"].astype("string")
+        out.to_parquet(fname, index=False)
+        if EXPORT_CSV:
+            out.to_csv(TARGET_FILE, index=False, mode="a" if i else "w",
+                       header=not i)
+        n_obs += out.shape[0]
+        n_positive += out["extensive"].sum()
+        n_missing += out.isna().sum()
+    print(f">>> Saved files with {n_obs:,} observations and "
+          f"{n_positive:,.0f} positive incidences")
     print(">>> Share of missing values per variable:")
-    print(out.isna().sum()/out.shape[0] * 100)
+    print(n_missing/n_obs * 100)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
+"""Estimates OLS, 2SLS and logit specifications on the adviser-department
+distance master and writes the regression tables.
+
+Logit models include fixed effects as sparse dummies and are estimated by
+Newton's method with sparse LU factorizations of the Hessian.  Observations
+without placement can be subsampled (case-control sampling with inverse
+probability weights).
+
+The IV probit and summary statistics remain in
+_890_analyze_distance_master.do.
+"""
+
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import splu
+from scipy.special import expit
+from scipy.stats import norm
+
+from _690_analyze_centrality_master import Demeaner, cluster_vcov, encode,\
+    estimate, write_table
+from _880_create_adv_distance_master import read_distance_master
+
+CENTR = "adv_ev-w-win99-std"
+FIRST = "first_ev-w-win99-std_mean"
+FIXED_EFFECTS = ["adv_scopus", "adv_experience", "stu_year"]
+CLUSTERS = ["adv_scopus", "school_scopus"]
+
+CONTROL_SHARE = 1.0  # Share of observations without placement used in logits
+SEED = 0
+
+INDICATORS = {"adv_scopus": "Adviser FE",
+              "adv_experience": "Adviser experience FE",
+              "stu_year": "Graduation year FE"}
+LABELS = {
+    "extensive": "Placed student", "plc_score-w": "Placement score",
+    "school_score-w": "PhD school score", "adv_euclid": "Adviser Euclid",
+    "adv_experience": "Adviser experience", CENTR: "Adviser centrality",
+    FIRST: "Adviser's coauthors centrality",
+    "coauthor_dist": "Social distance before death",
+    "coauthor_d_dist": "Social distance after death",
+    "coauthor_dist_diff": "Increase in social distance after death",
+    "coauthor_r_dist": "Social distance after random death",
+    "coauthor_r_dist_diff": "Increase in social distance after random death",
+    "citation_dist": "Citation distance",
+    "plc_close": "Distance to placement < 5"}
+
+
+def drop_separated(df, y, fes):
+    """Iteratively drop observations in fixed-effect groups whose outcome
+    does not vary, as they perfectly predict the outcome.
+    """
+    while True:
+        keep = np.ones(df.shape[0], dtype=bool)
+        for fe in fes:
+            keep &= (df.groupby(fe)[y].transform("nunique") > 1).to_numpy()
+        if keep.all():
+            return df
+        df = df[keep]
+
+
+def estimate_logit(df, y, exog, fes=FIXED_EFFECTS, clusters=CLUSTERS,
+                   control_share=CONTROL_SHARE, seed=SEED, tol=1e-8,
+                   max_iter=100, max_halvings=30):
+    """Estimate logit of binary y on exogenous variables and fixed effects
+    `fes`, with multi-way clustered standard errors.
+
+    With `control_share` < 1, only this share of observations with y = 0
+    is used, each weighted by the inverse of the share.  Newton steps are
+    halved until they do not decrease the log-likelihood.
+    """
+    cols = list(dict.fromkeys([y] + exog + fes + clusters))
+    df = df.dropna(subset=cols)
+    if control_share < 1:
+        rng = np.random.default_rng(seed)
+        keep = rng.random(df.shape[0]) < control_share
+        df = df[(df[y] == 1).to_numpy() | keep]
+    df = drop_separated(df, y, fes)
+    # Omit regressors collinear with fixed effects or preceding regressors
+    demeaned = Demeaner(df, fes)(exog)
+    keep = []
+    for i in range(len(exog)):
+        if np.linalg.matrix_rank(demeaned[:, keep + [i]]) > len(keep):
+            keep.append(i)
+    exog = [exog[i] for i in keep]
+    outcome = df[y].to_numpy(dtype="float64")
+    weights = np.where(outcome == 1, 1, 1/control_share)
+    mean = np.average(outcome, weights=weights)  # Of the estimation sample
+    X = make_design(df, exog, fes)
+
+    def loglik(b):
+        eta = X @ b
+        return (weights*(outcome*eta - np.logaddexp(0, eta))).sum()
+    # Newton's method with step halving
+    beta = np.zeros(X.shape[1])
+    ll = loglik(beta)
+    for _ in range(max_iter):
+        prob = expit(X @ beta)
+        grad = X.T @ (weights*(outcome-prob))
+        hess = (X.T @ sparse.diags(weights*prob*(1-prob)) @ X).tocsc()
+        lu = splu(hess)
+        step = lu.solve(grad)
+        for _ in range(max_halvings):
+            new_ll = loglik(beta + step)
+            if new_ll >= ll - 1e-12*abs(ll):
+                break
+            step /= 2
+        beta += step
+        ll = new_ll
+        if np.abs(step).max() < tol:
+            break
+    else:
+        warn(f"Logit of {y} did not converge in {max_iter} iterations")
+    # Clustered standard errors from scores projected on exogenous variables
+    k = len(exog)
+    prob = expit(X @ beta)
+    inv = lu.solve(np.eye(X.shape[1])[:, :k])
+    scores = (X @ inv) * (weights*(outcome-prob))[:, None]
+    codes = [encode(df[c].to_numpy()) for c in clusters]
+    n_obs = df.shape[0]
+    vcov = cluster_vcov(scores, np.ones(n_obs), np.eye(k), codes,
+                        dof=(n_obs, 1))  # Only G/(G-1) corrections
+    se = np.sqrt(np.diag(vcov))
+    p = 2*norm.sf(np.abs(beta[:k]/se))
+    return {"depvar": y, "fes": fes, "N": int(round(weights.sum())),
+            "N_adv": codes[0].max()+1, "mean": mean,
+            "params": pd.Series(beta[:k], index=exog),
+            "se": pd.Series(se, index=exog), "p": pd.Series(p, index=exog)}
+
+
+def keep_placing(df):
+    """Drop advisers without placements."""
+    placements = df.groupby("adv_scopus")["extensive"].transform("sum")
+    return df[placements > 0]
+
+
+def make_design(df, exog, fes):
+    """Build sparse design matrix with exogenous variables, a constant and
+    dummies for all but the first level of each fixed effect.
+    """
+    n_obs = df.shape[0]
+    rows = np.arange(n_obs)
+    blocks = [sparse.csr_matrix(df[exog].to_numpy(dtype="float64")),
+              sparse.csr_matrix(np.ones((n_obs, 1)))]
+    for fe in fes:
+        codes = encode(df[fe].to_numpy())
+        dummies = sparse.csr_matrix((np.ones(n_obs), (rows, codes)),
+                                    shape=(n_obs, codes.max()+1))
+        blocks.append(dummies[:, 1:])
+    return sparse.hstack(blocks, format="csr")
+
+
+def prepare(df):
+    """Construct variables used in the regressions."""
+    df = df.copy()
+    df["extensive"] = df["extensive"].fillna(0)
+    df["coauthor_dist_diff"] = df["coauthor_d_dist"] - df["coauthor_dist"]
+    df["coauthor_r_dist_diff"] = df["coauthor_r_dist"] - df["coauthor_dist"]
+    df["plc_close"] = (df["coauthor_dist"] < 5).astype(float)
+    df = keep_placing(df)
+    return df.dropna(subset=["plc_score-w"]).reset_index(drop=True)
+
+
+def main():
+    df = prepare(read_distance_master())
+    caches = {}
+    options = {"fixed_effects": INDICATORS, "labels": LABELS}
+
+    def est(data, y, exog, **kwds):
+        return estimate(data, y, exog, fes=FIXED_EFFECTS, clusters=CLUSTERS,
+                        cache=caches.setdefault(id(data), {}), **kwds)
+
+    # Social proximity threshold effects
+    controls = ["adv_euclid", "school_score-w", "plc_score-w"]
+    samples = [None, df["coauthor_dist"] > 1, df["coauthor_dist"] > 2]
+    models = [est(df, "extensive", ["plc_close"] + controls, sample=sample,
+                  small=True) for sample in samples]
+    write_table(models, "distance_ols_proximity.tex", **options)
+
+    # Distance for students placed
+    controls = ["adv_euclid", "school_score-w"]
+    placed = df["extensive"] == 1
+    models = []
+    for y in ("plc_close", "coauthor_d_dist"):
+        models.append(est(df, y, [FIRST] + controls, sample=placed, small=True))
+        models.append(est(df, y, controls, endog=CENTR, instrument=FIRST,
+                          sample=placed))
+    write_table(models, "distance_2sls_closeplacement.tex", order=[CENTR, FIRST],
+                **options)
+
+    # Baseline on all institutions, hiring institutions and those with PhD
+    hiring = df[df["hiring"].notnull()].reset_index(drop=True)
+    phd = keep_placing(hiring[hiring["plc_phd"] == 1]).reset_index(drop=True)
+    controls = ["adv_euclid", "school_score-w", "plc_score-w"]
+    specs = {"baseline": ["coauthor_dist_diff", "coauthor_dist"],
+             "citation": ["coauthor_dist_diff", "coauthor_dist", "citation_dist"],
+             "random": ["coauthor_r_dist_diff", "coauthor_dist"]}
+    for name, variables in specs.items():
+        models = [est(data, "extensive", variables + controls, small=True)
+                  for data in (df, hiring, phd)]
+        write_table(models, f"distance_ols_{name}.tex", order=variables,
+                    mean=name != "random", **options)
+
+    # Logit
+    variables = specs["baseline"]
+    models = [estimate_logit(data, "extensive", variables + controls)
+              for data in (df, hiring, phd)]
+    write_table(models, "distance_logit_baseline.tex", order=variables,
+                mean=True, **options)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ import pandas as pd
 import seaborn as sns
 
 from _680_create_centrality_masters import read_agg_centr
+from panel_ops import group_diff, group_rebase
 
 sns.set(style="whitegrid", font='Utopia')
 plt.rcParams["font.family"] = "serif"
@@ -42,11 +43,6 @@ def make_lineplots(df, fname, figsize=(13, 7)):
     plt.clf()
 
 
-def rebase(s):
-    """Rebase series to its initial value."""
-    return s/s.iloc[0]
-
-
 def main():
     # Get relevant advisers
     cols = ['plc_year', 'adv_occ', 'best_adviser']
@@ -60,8 +56,8 @@ def main():
     centr = centr[centr["year"] <= 2006]
 
     # Compute differences
-    centr["rebased"] = centr.groupby("node")[PLOT_CENTR].apply(rebase)
-    centr["delta"] = centr.groupby("node")[PLOT_CENTR].diff()
+    centr["rebased"] = group_rebase(centr[PLOT_CENTR], centr["node"])
+    centr["delta"] = group_diff(centr[PLOT_CENTR], centr["node"])
 
     # Plot rebased value and first differences
     label = PLOT_CENTR.split("_", 1)[1].replace("-", "")
@@ -14,6 +14,7 @@ import seaborn as sns
 from numpy import median
 from scipy.stats import median_test
 
+from _005_parse_students import read_registry, student_keys
 from _625_compile_adviser_data import REFERENCE_YEAR
 
 MAPPING_FILE = Path("./090_institution_data/mapping.csv")
@@ -104,10 +105,14 @@ def main():
     adv_actual = adv_actual["adv_scopus"].str.split(";").explode()
     adv_actual = (adv_actual.dropna().astype("uint64")
                             .reset_index().set_index("adv_scopus"))
-    adv_actual = adv_actual["stu_id"].str.split(";", expand=True)
-    adv_actual.columns = ["name", "university", "year"]
-    adv_actual = adv_actual.drop(columns="name").reset_index()
-    adv_actual["year"] = adv_actual["year"].astype("uint16")
+    registry = read_registry()
+    adv_actual["stu_key"] = student_keys(adv_actual["stu_id"], registry)
+    rename = {"stu_school": "university", "stu_year": "year"}
+    adv_actual = (adv_actual[adv_actual["stu_key"] >= 0]
+                  .join(registry[["stu_school", "stu_year"]], on="stu_key")
+                  .rename(columns=rename)
+                  .drop(columns=["stu_id", "stu_key"]).reset_index())
+    adv_actual["university"] = adv_actual["university"].astype(str)
     university = adv_actual.groupby("adv_scopus").apply(find_university)
 
     # Add school rank
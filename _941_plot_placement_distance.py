@@ -14,6 +14,9 @@ import seaborn as sns
 from numpy import nan
 from tqdm import tqdm
 
+from _117_get_faculty_lists import AuthorRegistry, read_faculty
+from _206_build_coauthor_networks import read_network
+
 SOURCE_FILE = Path("./680_centrality_masters/master.csv")
 FACULTY_FILE = Path("./117_faculty_lists/hasselback.csv")
 ADVISER_FILE = Path("./199_adviser-student_map/actual.csv")
@@ -98,7 +101,6 @@ def get_minimum_distance(G, sources, targets):
     """Measure distance between group of source nodes and target nodes."""
     distances = []
     for node1 in sources:
-        node1 = str(int(node1))
         for node2 in targets:
             try:
                 new = len(nx.shortest_path(G, source=node1, target=node2,
@@ -112,11 +114,11 @@ def get_minimum_distance(G, sources, targets):
         return None
 
 
-def read_networks():
+def read_networks(registry):
     """Read networkx files and return nested dictionary."""
     networks = {}
     for f in tqdm(sorted(NETWORK_FOLDER.glob("*.gexf"))):
-        G = nx.read_gexf(f)
+        G = read_network(f, registry)
         year = f.stem
         G.name = year
         networks[year] = G
@@ -131,16 +133,17 @@ def main():
     df["plc_year"] = df["plc_year"].astype(int).astype(str)
 
     # Merge committee members
+    registry = AuthorRegistry()
     adv = pd.read_csv(ADVISER_FILE, index_col="stu_id",
                       usecols=["stu_id", "adv_scopus", "comm_scopus"])
     for col in ["adv_scopus", 'comm_scopus']:
-        adv[col] = adv[col].str.split(";")
+        ids = adv[col].str.split(";").explode().dropna()
+        idx = pd.Series(registry.encode(ids), index=ids.index)
+        adv[col] = idx.groupby(level=0).agg(lambda s: s.tolist())
     df = df.join(adv, how="inner")
 
     # Read faculty file
-    hasselback = pd.read_csv(FACULTY_FILE, index_col="Scopus").drop(columns="country")
-    hasselback = hasselback.fillna("").applymap(lambda c: set(c.split(";")))
-    fac_lookup = hasselback.to_dict()
+    fac_lookup = read_faculty(registry, FACULTY_FILE)
 
     # Get faculty at placement
     df["plc_faculty"] = df.apply(lambda s: get_faculty(s, fac_lookup), axis=1)
@@ -153,7 +156,7 @@ def main():
 
     # Measure minimum social distance
     print(">>> Computing social distances...")
-    networks = read_networks()
+    networks = read_networks(registry)
     df = df.reset_index().set_index(["stu_id", "plc_scopus", "plc_type"])
     dist = df.apply(lambda s: adviser_placement_distance(s, networks), axis=1)
     print(f"Means: {dist['adv_dist'].mean():.2} (advisers) and "
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
+"""Local HTTP stand-ins for web services the crawlers query, to try them
+offline.
+
+RepecFixture serves genealogy pages with ETag and Last-Modified headers and
+answers conditional requests with 304 Not Modified.  Start a server with
+`serve()`, point the crawler to it and inspect the recorded requests:
+
+    server = serve(RepecFixture, pages={"pro123": "<ol><li>A</li></ol>"})
+    crawl(["pro123"], {}, base_url=server.url + "pages/")
+
+GenderizeMock answers batched name queries like genderize.io, including
+rate limit headers and 429 once its quota of requests is used up.  Clients
+of the genderize package reach it through `redirect()`:
+
+    server = serve(GenderizeMock, names={"anna": ("female", 0.98, 100)},
+                   quota=[10])
+    client = genderize.Genderize()
+    redirect(client.session, GENDERIZE_URL, server)
+"""
+
+import json
+from email.utils import formatdate, parsedate_to_datetime
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+GENDERIZE_URL = "https://api.genderize.io/"
+LAST_MODIFIED = 1_600_000_000  # Timestamp of all fixture pages
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Threaded HTTP server with fixture data and a log of requests."""
+    daemon_threads = True
+
+    def __init__(self, handler, **data):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.data = data
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+
+class GenderizeMock(BaseHTTPRequestHandler):
+    """Answer genderize.io queries from `server.data["names"]`, a dictionary
+    of lower-case names and tuples of gender, probability and count.
+
+    `server.data["quota"]` is a one-element list with the number of
+    remaining requests, and `server.data["status"]` an optional HTTP error
+    status returned for every request.
+    """
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        params = parse_qs(urlsplit(self.path).query)
+        quota = self.server.data.setdefault("quota", [1000])
+        status = self.server.data.get("status")
+        if status:
+            self.send_json(status, {"error": "Fixture error"}, quota[0])
+            return
+        if params.get("apikey") == ["invalid"]:
+            self.send_json(401, {"error": "Invalid API key"}, quota[0])
+            return
+        if quota[0] <= 0:
+            self.send_json(429, {"error": "Request limit reached"}, 0)
+            return
+        quota[0] -= 1
+        known = self.server.data.get("names", {})
+        data = []
+        for name in params.get("name[]", []):
+            gender, probability, count = known.get(name.lower(), (None, 0.0, 0))
+            data.append({"name": name, "gender": gender,
+                         "probability": probability, "count": count})
+        self.send_json(200, data if len(data) > 1 else data[0], quota[0])
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload, remaining):
+        body = json.dumps(payload).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Rate-Limit-Limit", "1000")
+        self.send_header("X-Rate-Limit-Remaining", str(remaining))
+        self.send_header("X-Rate-Limit-Reset", "3600")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RedirectAdapter(HTTPAdapter):
+    """Send requests for a URL prefix to a fixture server instead."""
+    def __init__(self, prefix, url):
+        super().__init__()
+        self.prefix = prefix
+        self.url = url
+
+    def send(self, request, **kwds):
+        request.url = self.url + request.url[len(self.prefix):]
+        return super().send(request, **kwds)
+
+
+class RepecFixture(BaseHTTPRequestHandler):
+    """Serve genealogy pages from `server.data["pages"]`, a dictionary of
+    handles and HTML, honouring If-None-Match and If-Modified-Since.
+    """
+    def do_GET(self):
+        handle = self.path.rsplit("/", 1)[-1].rsplit(".html", 1)[0]
+        self.server.requests.append((self.path, dict(self.headers)))
+        page = self.server.data.get("pages", {}).get(handle)
+        if page is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = '"' + md5(page.encode("utf8")).hexdigest() + '"'
+        if self.not_modified(etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = page.encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(LAST_MODIFIED, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+    def not_modified(self, etag):
+        """Evaluate conditional request headers, ETag first."""
+        if "If-None-Match" in self.headers:
+            return self.headers["If-None-Match"] == etag
+        since = self.headers.get("If-Modified-Since")
+        if since:
+            try:
+                return parsedate_to_datetime(since).timestamp() >= LAST_MODIFIED
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+def redirect(session, prefix, server):
+    """Route requests of `session` starting with `prefix` to `server`."""
+    session.mount(prefix, RedirectAdapter(prefix, server.url))
+
+
+def serve(handler, **data):
+    """Start fixture server with `handler` in a background thread."""
+    server = FixtureServer(handler, **data)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
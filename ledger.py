@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
+"""Durable ledger to checkpoint long-running acquisition stages.
+
+Completed work units and their results are appended to a journal
+(`.jsonl`), which is compacted into a snapshot (`.json`) once it holds as
+many units as the snapshot.  Each unit is thus rewritten only a few times
+over a run, even when results are bulky.  The ledger depends on the
+standard library only, so that stages can use it without importing other
+stages.
+"""
+
+import json
+from datetime import datetime
+from pathlib import Path
+from time import monotonic
+
+
+class Ledger:
+    """Durable record of completed work units and their results.
+
+    Completed units are appended to a journal, which is compacted into a
+    snapshot once it holds at least `compact_every` units and at least as
+    many units as the snapshot.  On restart, both are read so that
+    completed units can be skipped.
+    """
+    def __init__(self, fname, compact_every=500):
+        self.journal = Path(fname).with_suffix(".jsonl")
+        self.snapshot = Path(fname).with_suffix(".json")
+        self.compact_every = compact_every
+        self.done = {}
+        try:
+            self.done.update(json.loads(self.snapshot.read_text())["units"])
+        except FileNotFoundError:
+            pass
+        self._journaled = 0
+        try:
+            with open(self.journal, encoding="utf8") as inf:
+                for line in inf:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # Incomplete last line after crash
+                        continue
+                    self.done[entry["unit"]] = entry["data"]
+                    self._journaled += 1
+        except FileNotFoundError:
+            pass
+        self._new = 0
+        self._start = monotonic()
+        self._outf = None
+
+    def __contains__(self, unit):
+        return str(unit) in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def close(self):
+        """Compact journal and close it."""
+        self.compact()
+        if self._outf:
+            self._outf.close()
+            self._outf = None
+
+    def compact(self):
+        """Write all units to the snapshot and truncate the journal."""
+        stats = {"updated": datetime.now().isoformat(timespec="seconds"),
+                 "units": len(self.done), "new": self._new,
+                 "units_per_min": round(self.throughput()*60, 2)}
+        temp = self.snapshot.with_suffix(".tmp")
+        temp.write_text(json.dumps({"stats": stats, "units": self.done}))
+        temp.replace(self.snapshot)
+        if self._outf:
+            self._outf.close()
+        self._outf = open(self.journal, "w", encoding="utf8")
+        self._journaled = 0
+
+    def record(self, unit, data=None):
+        """Mark a unit as completed and store its result."""
+        if self._outf is None:
+            self._outf = open(self.journal, "a", encoding="utf8")
+            self._outf.write("\n")  # Terminate line torn by a crash
+        unit = str(unit)
+        self._outf.write(json.dumps({"unit": unit, "data": data}) + "\n")
+        self._outf.flush()
+        self.done[unit] = data
+        self._new += 1
+        self._journaled += 1
+        in_snapshot = len(self.done) - self._journaled
+        if self._journaled >= max(self.compact_every, in_snapshot):
+            self.compact()
+
+    def status(self):
+        """Return one-line summary of progress."""
+        return (f"{len(self.done):,} units done ({self._new:,} new at "
+                f"{self.throughput()*60:,.1f}/min)")
+
+    def throughput(self):
+        """Return no. of units completed per second in this session."""
+        return self._new/max(monotonic() - self._start, 1e-9)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Author:   Michael E. Rose <michael.ernst.rose@gmail.com>
+"""Vectorised kernels on panels keyed on entity and year: grouped
+standardization, winsorization, rebasing, differences and leads/lags.
+
+The kernels work on factorized group codes and sorted arrays and return
+values aligned with their input, like groupby().transform().  They depend
+on NumPy and pandas only, so that stages can use them without importing
+other stages.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def group_diff(s, by):
+    """Compute difference to the previous row of the same group."""
+    codes = pd.factorize(by)[0]
+    x = s.to_numpy(dtype="float64")
+    order = np.argsort(codes, kind="stable")
+    same = codes[order[1:]] == codes[order[:-1]]
+    out = np.full(x.shape[0], np.nan)
+    out[order[1:][same]] = x[order[1:][same]] - x[order[:-1][same]]
+    return pd.Series(out, index=s.index, name=s.name)
+
+
+def group_rebase(s, by):
+    """Rebase values to the first value of their group."""
+    codes = pd.factorize(by)[0]
+    x = s.to_numpy(dtype="float64")
+    _, first = np.unique(codes, return_index=True)
+    return pd.Series(x/x[first][codes], index=s.index, name=s.name)
+
+
+def group_standardize(s, by):
+    """Standardize values within groups."""
+    codes, uniques = pd.factorize(by)
+    x = s.to_numpy(dtype="float64")
+    valid = ~np.isnan(x)
+    n = np.bincount(codes[valid], minlength=len(uniques))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(codes[valid], x[valid], len(uniques))/n
+        dev = x - mean[codes]
+        var = np.bincount(codes[valid], dev[valid]**2, len(uniques))/(n-1)
+        return pd.Series(dev/np.sqrt(var)[codes], index=s.index, name=s.name)
+
+
+def group_winsorize(s, by, level=0.01):
+    """Winsorize values within groups at specified level."""
+    codes, uniques = pd.factorize(by)
+    x = s.to_numpy(dtype="float64")
+    valid = np.flatnonzero(~np.isnan(x))
+    order = valid[np.lexsort((x[valid], codes[valid]))]
+    values = x[order]
+    n = np.bincount(codes[valid], minlength=len(uniques))
+    start = np.cumsum(n) - n
+    bounds = []
+    for q in (level, 1-level):
+        # Linear interpolation between closest ranks, as in numpy
+        pos = (n-1)*q
+        low = np.floor(pos).astype(int)
+        high = np.minimum(low+1, n-1)
+        frac = pos - low
+        nonempty = n > 0
+        a = np.full(len(uniques), np.nan)
+        b = np.full(len(uniques), np.nan)
+        a[nonempty] = values[(start+low)[nonempty]]
+        b[nonempty] = values[(start+high)[nonempty]]
+        diff = b - a
+        bounds.append(np.where(frac >= 0.5, b - diff*(1-frac), a + diff*frac))
+    out = np.clip(x, bounds[0][codes], bounds[1][codes])
+    return pd.Series(out, index=s.index, name=s.name)
+
+
+def shift_panel(df, cols, t, entity="node", year="year"):
+    """Return values of `cols` of the same entity `t` years later (leads
+    for positive, lags for negative `t`), aligned with the rows of `df`.
+    """
+    codes = pd.factorize(df[entity])[0].astype("int64")
+    years = df[year].to_numpy(dtype="int64")
+    first, span = years.min(), years.max() - years.min() + 1
+    keys = codes*span + years - first
+    order = np.argsort(keys, kind="stable")
+    target = years + t
+    valid = (target >= first) & (target < first+span)
+    pos = np.searchsorted(keys[order], codes*span + target - first)
+    pos = np.minimum(pos, keys.shape[0]-1)
+    found = valid & (keys[order][pos] == codes*span + target - first)
+    out = df[cols].iloc[order[pos]].set_axis(df.index)
+    return out.where(np.broadcast_to(found[:, None], out.shape))